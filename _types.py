@@ -26,11 +26,94 @@ class Stock(Item):
     quantity: int
 
 
+class Customer(TypedDict):
+    _id: int
+    total_spent: int
+    transaction_count: int
+    last_purchase_at: datetime
+    tier: int
+
+
+class Revenue(TypedDict):
+    _id: str
+    total: int
+    count: int
+
+
+class SalesCounter(TypedDict):
+    _id: str
+    count: int
+    earnings: int
+
+
+class TicketCounter(TypedDict):
+    _id: str
+    seq: int
+
+
+class StockBoard(TypedDict):
+    _id: str
+    channel_id: NotRequired[int]
+    message_id: NotRequired[int]
+    digest: NotRequired[str]
+
+
+class TicketChannels(TypedDict):
+    _id: str
+    guild_id: int
+    category: str
+    category_id: NotRequired[int]
+    transcripts_id: NotRequired[int]
+
+
+class TicketMessage(TypedDict):
+    _id: int
+    channel_id: int
+    author_id: int
+    author: str
+    avatar_url: str
+    bot: bool
+    content: str
+    embeds: list[dict]
+    attachments: list[dict]
+    created_at: datetime
+    edited_at: NotRequired[datetime]
+    deleted: NotRequired[bool]
+
+
+class TranscriptMetadata(TypedDict):
+    name: str
+    category: str
+    creator: str
+    creator_id: int
+    closer: str
+    closer_id: int
+    created_at: datetime
+    closed_at: datetime
+
+
+class TranscriptJob(TypedDict):
+    _id: NotRequired[ObjectId]
+    channel_id: int
+    transcripts_id: int
+    embed: dict
+    metadata: TranscriptMetadata
+    captured: NotRequired[bool]
+    status: str
+    attempts: int
+    posted: NotRequired[bool]
+    error: NotRequired[str]
+    created_at: datetime
+    available_at: datetime
+    claimed_at: NotRequired[datetime]
+
+
 class TicketData(TypedDict):
     payment_method: str
     items: list[str]
     subtotal: int
     total: int
+    reserved: NotRequired[dict[str, int]]
 
 
 class Ticket(TypedDict):
@@ -40,4 +123,5 @@ class Ticket(TypedDict):
     username: str
     category: str
     open: bool
+    captured: NotRequired[bool]
     data: NotRequired[TicketData]
@@ -1,15 +1,73 @@
 import logging
 import os
+from datetime import datetime
 
 import discord
 from discord.ext import commands
-from pymongo import MongoClient
-from pymongo.database import Database
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
-from utils import ActionCache
+from catalog import StockCatalog
+from sheets import SheetExporter, SheetSession
+from ticket_log import TicketMessageStore
+from ticketing import OpenTicketCache, TicketChannelResolver
+from transcript_index import TranscriptIndex
+from transcripts import TranscriptQueue
+from utils import ActionCache, customer_rollup
 
 _log = logging.getLogger(__name__)
 
+indexes = {
+    "tickets": [
+        IndexModel([("channel_id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("category", ASCENDING), ("open", ASCENDING)]),
+    ],
+    "logs": [
+        IndexModel([("user_id", ASCENDING)]),
+        IndexModel([("created_at", ASCENDING)]),
+    ],
+    "stock": [
+        IndexModel([("set", ASCENDING), ("name", ASCENDING)], unique=True),
+    ],
+    "ticket_messages": [
+        IndexModel([("channel_id", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "transcript_jobs": [
+        IndexModel([("status", ASCENDING), ("available_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("claimed_at", ASCENDING)]),
+    ],
+}
+
+# Representative filters for the hot queries, explained at startup to catch collection scans.
+query_shapes = {
+    "tickets": [
+        {"channel_id": 0},
+        {"user_id": 0, "category": "", "open": True},
+    ],
+    "logs": [
+        {"user_id": 0},
+        {"created_at": {"$gte": datetime.min}},
+    ],
+    "stock": [
+        {"set": "", "name": ""},
+    ],
+    "ticket_messages": [
+        {"channel_id": 0},
+    ],
+    "transcript_jobs": [
+        {"status": "pending", "available_at": {"$lte": datetime.min}},
+    ],
+}
+
+
+def _has_stage(plan: dict | list, stage: str) -> bool:
+    if isinstance(plan, list):
+        return any(_has_stage(x, stage) for x in plan)
+    if isinstance(plan, dict):
+        return plan.get("stage") == stage or any(_has_stage(x, stage) for x in plan.values())
+    return False
+
 
 class Bot(commands.Bot):
     def __init__(self):
@@ -18,13 +76,61 @@ class Bot(commands.Bot):
         intents = discord.Intents.all()
         super().__init__(",", help_command=None, intents=intents)
         self.config: BotConfig = None
-        self.database = self._get_database(name="bry")
+        self.database: AsyncIOMotorDatabase = None
         self.action_cache = ActionCache(None, None, None, None, None)
+        self.sheet_exporter: SheetExporter = None
+        self.catalog: StockCatalog = None
+        self.ticket_channels: TicketChannelResolver = None
+        self.open_tickets = OpenTicketCache()
+        self.transcripts: TranscriptQueue = None
+        self.transcript_index = TranscriptIndex()
+        self.ticket_messages: TicketMessageStore = None
 
-    def _get_database(self, **options) -> Database:
-        return MongoClient(os.getenv("ATLAS_URI")).get_database(**options)
+    def _get_database(self, **options) -> AsyncIOMotorDatabase:
+        client = AsyncIOMotorClient(
+            os.getenv("ATLAS_URI"),
+            maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+            minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", 5)),
+            connectTimeoutMS=5000,
+            serverSelectionTimeoutMS=5000,
+            socketTimeoutMS=20000,
+            waitQueueTimeoutMS=5000,
+        )
+
+        return client.get_database(**options)
 
     async def setup_hook(self) -> None:
+        self.database = self._get_database(name="bry")
+        await self.database.command("ping")
+        _log.info("Connected to database %s.", self.database.name)
+
+        await self._ensure_indexes()
+        await self._seed_ticket_counter()
+        await self._seed_sales_totals()
+
+        self.sheet_exporter = SheetExporter(SheetSession(os.getenv("SPREADSHEET_ID")))
+        self.sheet_exporter.start()
+
+        self.catalog = StockCatalog(self.database.get_collection("stock"))
+        await self.catalog.load()
+        self.catalog.start()
+
+        self.ticket_channels = TicketChannelResolver(self.database.get_collection("ticket_channels"))
+        await self.ticket_channels.load()
+        await self.open_tickets.load(self.database.get_collection("tickets"))
+
+        self.ticket_messages = TicketMessageStore(self.database.get_collection("ticket_messages"))
+        await self.ticket_messages.load(self.database.get_collection("tickets"))
+
+        self.transcripts = TranscriptQueue(
+            self.database.get_collection("transcript_jobs"),
+            self,
+            self.transcript_index,
+            self.ticket_messages,
+            workers=int(os.getenv("TRANSCRIPT_WORKERS", 2)),
+        )
+        self.transcripts.start()
+
         for filename in os.listdir("cogs"):
             if filename.endswith(".py"):
                 cog = filename[:-3]
@@ -40,3 +146,84 @@ class Bot(commands.Bot):
                     await self.load_extension(f"views.{view}")
                 except Exception as e:
                     _log.warning(f"View '{view}' raised an exception: {e.__class__.__name__}: {e}")
+
+    async def _ensure_indexes(self) -> None:
+        """Creates the required indexes and warns about query shapes that still scan."""
+
+        for name, models in indexes.items():
+            collection = self.database.get_collection(name)
+
+            for model in models:
+                try:
+                    await collection.create_indexes([model])
+                except OperationFailure as e:
+                    _log.warning("Could not create index %s on %s: %s", model.document["name"], name, e)
+
+        for name, filters in query_shapes.items():
+            collection = self.database.get_collection(name)
+
+            for filter in filters:
+                explained = await collection.find(filter).explain()
+                winning_plan = explained.get("queryPlanner", {}).get("winningPlan", {})
+
+                if _has_stage(winning_plan, "COLLSCAN"):
+                    _log.warning("Query on %s with keys %s runs unindexed.", name, list(filter))
+
+    async def _seed_ticket_counter(self) -> None:
+        """Starts the ticket sequence after the existing tickets the first time it is used."""
+
+        counter_collection = self.database.get_collection("counters")
+        if await counter_collection.find_one({"_id": "tickets"}) is not None:
+            return
+
+        ticket_count = await self.database.get_collection("tickets").count_documents({})
+
+        try:
+            await counter_collection.update_one(
+                {"_id": "tickets"},
+                {"$setOnInsert": {"seq": ticket_count}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Another process seeded it first.
+            pass
+
+    async def _seed_sales_totals(self) -> None:
+        """Builds the sales counters and customer totals from the purchase logs the first time they are used."""
+
+        counter_collection = self.database.get_collection("counters")
+        if await counter_collection.find_one({"_id": "sales"}) is not None:
+            return
+
+        log_collection = self.database.get_collection("logs")
+        pipeline = [{"$group": {"_id": None, "count": {"$sum": 1}, "earnings": {"$sum": "$item.price"}}}]
+        totals = await log_collection.aggregate(pipeline).to_list(length=1)
+        totals = totals[0] if totals else {"count": 0, "earnings": 0}
+
+        # Customers written since the logs were read keep their live totals.
+        await log_collection.aggregate(customer_rollup("keepExisting")).to_list(length=None)
+
+        try:
+            await counter_collection.update_one(
+                {"_id": "sales"},
+                {"$setOnInsert": {"count": totals["count"], "earnings": totals["earnings"]}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Another process seeded it first.
+            pass
+
+    async def close(self) -> None:
+        await super().close()
+
+        if self.sheet_exporter is not None:
+            await self.sheet_exporter.stop()
+
+        if self.catalog is not None:
+            await self.catalog.stop()
+
+        if self.transcripts is not None:
+            await self.transcripts.stop()
+
+        if self.database is not None:
+            self.database.client.close()
@@ -0,0 +1,505 @@
+import asyncio
+import bisect
+import heapq
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable
+
+import discord
+from bson import ObjectId
+from discord import app_commands as apc
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+
+from _types import Stock
+from utils import calc_discount, split_list
+
+_log = logging.getLogger(__name__)
+
+
+@dataclass
+class StockSet:
+    name: str
+    price: int = 0
+    total_quantity: int = 0
+    items: list[Stock] = field(default_factory=list)
+
+
+class StockSearchIndex:
+    """In-memory n-gram index over "set name" labels for stock autocomplete.
+
+    Every 1-, 2- and 3-gram of a label maps to the items containing it, so a
+    short query is a single lookup and a longer one intersects its trigram
+    postings before confirming the substring. Matches rank prefix first, then
+    word start, then any substring, alphabetically within a rank.
+
+    Ranked results are memoized per query and only invalidated when a label is
+    added, removed or renamed. Choices are prebuilt per item, so stock and price
+    changes just swap that item's choice.
+    """
+
+    gram_size = 3
+    cache_size = 4096
+
+    def __init__(self, items: list[Stock] = ()):
+        self.labels: dict[ObjectId, str] = {}
+        self.choices: dict[ObjectId, apc.Choice[str]] = {}
+        self.grams: dict[str, set[ObjectId]] = defaultdict(set)
+        self._order: list[ObjectId] = None
+        self._sorted_labels: list[str] = None
+        self._ordinals: dict[ObjectId, int] = None
+        self._cache: dict[str, list[ObjectId]] = {}
+
+        for item in items:
+            self.add(item)
+
+    @staticmethod
+    def _choice(item: Stock) -> apc.Choice[str]:
+        display_item = f"{item.get('set') or ''} {item['name']} (${item['price']})".strip()
+
+        if item["quantity"] < 1:
+            name = f"{display_item} | Out of Stock"
+        else:
+            name = f"{display_item} | Stock: {item['quantity']}"
+
+        return apc.Choice(name=name[:100], value=str(item["_id"]))
+
+    def _grams(self, label: str) -> set[str]:
+        return {
+            label[i:i + size]
+            for size in range(1, self.gram_size + 1)
+            for i in range(len(label) - size + 1)
+        }
+
+    def add(self, item: Stock) -> None:
+        item_id = item["_id"]
+        label = f"{item.get('set') or ''} {item['name']}".strip().lower()
+        self.choices[item_id] = self._choice(item)
+
+        if self.labels.get(item_id) == label:
+            return
+
+        self.remove(item_id)
+        self.choices[item_id] = self._choice(item)
+        self.labels[item_id] = label
+
+        for gram in self._grams(label):
+            self.grams[gram].add(item_id)
+
+        self._invalidate()
+
+    def remove(self, item_id: ObjectId) -> None:
+        label = self.labels.pop(item_id, None)
+        self.choices.pop(item_id, None)
+
+        if label is None:
+            return
+
+        for gram in self._grams(label):
+            postings = self.grams[gram]
+            postings.discard(item_id)
+            if not postings:
+                del self.grams[gram]
+
+        self._invalidate()
+
+    def search(self, query: str, limit: int = 25) -> list[apc.Choice[str]]:
+        query = query.strip().lower()
+
+        item_ids = self._cache.get(query)
+        if item_ids is None:
+            item_ids = self._rank(query)
+
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[query] = item_ids
+
+        return [self.choices[item_id] for item_id in item_ids[:limit]]
+
+    def _rank(self, query: str, limit: int = 25) -> list[ObjectId]:
+        if self._order is None:
+            self._order = sorted(self.labels, key=self.labels.__getitem__)
+            self._sorted_labels = [self.labels[item_id] for item_id in self._order]
+            self._ordinals = {item_id: i for i, item_id in enumerate(self._order)}
+
+        if not query:
+            return self._order[:limit]
+
+        # Prefix matches are a contiguous run of the sorted labels and outrank everything
+        # else, so when there are enough of them no candidate needs to be looked at.
+        start = bisect.bisect_left(self._sorted_labels, query)
+        end = bisect.bisect_left(self._sorted_labels, query + "\uffff", start)
+        if end - start >= limit:
+            return self._order[start:start + limit]
+
+        if len(query) <= self.gram_size:
+            candidates = self.grams.get(query, ())
+        else:
+            postings = sorted(
+                (self.grams.get(query[i:i + self.gram_size], set()) for i in range(len(query) - self.gram_size + 1)),
+                key=len,
+            )
+            candidates = set.intersection(*postings)
+
+        # Rank and alphabetical position folded into one integer so the heap compares ints.
+        size = len(self._order)
+        word_start = f" {query}"
+        keys = []
+
+        for item_id in candidates:
+            label = self.labels[item_id]
+
+            if label.startswith(query):
+                rank = 0
+            elif word_start in label:
+                rank = 1
+            elif query in label:
+                rank = 2
+            else:
+                continue
+
+            keys.append(rank * size + self._ordinals[item_id])
+
+        return [self._order[key % size] for key in heapq.nsmallest(limit, keys)]
+
+    def _invalidate(self) -> None:
+        self._order = None
+        self._sorted_labels = None
+        self._ordinals = None
+        self._cache.clear()
+
+
+class StockCatalog:
+    """Process-wide cache of the stock collection.
+
+    Items are keyed by ``_id`` and kept current from a change stream, falling
+    back to polling when the deployment does not support one. Groupings and
+    sort orders are derived lazily and cached until the next change, which
+    bumps ``version``.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, poll_interval: float = 60):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.items: dict[ObjectId, Stock] = {}
+        self.version = 0
+        self.search_index = StockSearchIndex()
+        self._listeners: list[Callable[[], None]] = []
+        self._derived: dict[str, object] = {}
+        self._task: asyncio.Task = None
+
+    async def load(self) -> None:
+        """Reloads every item from the database."""
+
+        items = {item["_id"]: item async for item in self.collection.find()}
+
+        if items == self.items:
+            return
+
+        for item_id in self.items.keys() - items.keys():
+            self.search_index.remove(item_id)
+
+        for item_id, item in items.items():
+            if self.items.get(item_id) != item:
+                self.search_index.add(item)
+
+        self.items = items
+        self._changed()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """Registers a callback run whenever the stock changes."""
+
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def get(self, item_id: str | ObjectId) -> Stock | None:
+        try:
+            return self.items.get(ObjectId(item_id))
+        except Exception:
+            return None
+
+    def put(self, item: Stock) -> None:
+        """Applies a write made by this process without waiting for the change stream."""
+
+        if self.items.get(item["_id"]) != item:
+            self.items[item["_id"]] = item
+            self.search_index.add(item)
+            self._changed()
+
+    def discard(self, item_id: ObjectId) -> None:
+        if self.items.pop(item_id, None) is not None:
+            self.search_index.remove(item_id)
+            self._changed()
+
+    def search(self, query: str, limit: int = 25) -> list[apc.Choice[str]]:
+        """Returns autocomplete choices for items whose "set name" contains ``query``."""
+
+        return self.search_index.search(query, limit)
+
+    async def reserve(self, quantities: dict[ObjectId, int]) -> list[ObjectId]:
+        """Atomically takes ``quantities`` out of stock.
+
+        Each item is claimed with a conditional ``$inc`` that only matches while
+        enough is left, so concurrent checkouts can never oversell. Returns the
+        IDs that could not be claimed, in which case nothing stays reserved. If
+        a claim raises, the items already claimed are released before the error
+        is re-raised.
+        """
+
+        item_ids = list(quantities)
+        results = await asyncio.gather(*(
+            self.collection.find_one_and_update(
+                {"_id": item_id, "quantity": {"$gte": quantities[item_id]}},
+                {"$inc": {"quantity": -quantities[item_id]}},
+                return_document=ReturnDocument.AFTER,
+            )
+            for item_id in item_ids
+        ), return_exceptions=True)
+
+        claimed = {}
+        unavailable = []
+        error = None
+
+        for item_id, result in zip(item_ids, results):
+            if isinstance(result, BaseException):
+                error = error or result
+            elif result is None:
+                unavailable.append(item_id)
+            else:
+                claimed[item_id] = quantities[item_id]
+                self.put(result)
+
+        if error is not None or unavailable:
+            await self.release(claimed)
+
+        if error is not None:
+            raise error
+
+        return unavailable
+
+    async def release(self, quantities: dict[ObjectId, int]) -> None:
+        """Returns reserved quantities to stock and applies the new counts locally."""
+
+        if not quantities:
+            return
+
+        results = await asyncio.gather(*(
+            self.collection.find_one_and_update(
+                {"_id": item_id},
+                {"$inc": {"quantity": quantity}},
+                return_document=ReturnDocument.AFTER,
+            )
+            for item_id, quantity in quantities.items()
+        ))
+
+        for item in results:
+            if item is not None:
+                self.put(item)
+
+    @property
+    def sets(self) -> dict[str, StockSet]:
+        """Items grouped by set in set-name order, with unset items last and each set sorted by price."""
+
+        return self._derive("sets", self._build_sets)
+
+    def _build_sets(self) -> dict[str, StockSet]:
+        sets: dict[str, StockSet] = {}
+
+        for item in self.items.values():
+            set_name = item.get("set") or ""
+            stock_set = sets.setdefault(set_name, StockSet(set_name))
+            stock_set.price += item["price"]
+            stock_set.total_quantity += item["quantity"]
+            stock_set.items.append(item)
+
+        for stock_set in sets.values():
+            stock_set.items.sort(key=lambda x: (x["price"], x["name"]))
+
+        return {name: sets[name] for name in sorted(sets, key=lambda x: (x == "", x))}
+
+    @property
+    def snapshot(self) -> dict[ObjectId, Stock]:
+        """A copy of ``items`` that stays fixed once taken, shared until the next change."""
+
+        return self._derive("snapshot", lambda: dict(self.items))
+
+    @property
+    def purchase_options(self) -> list[list[discord.SelectOption]]:
+        """In-stock sets and items as shop dropdown options, in chunks of 25.
+
+        Built once per ``version`` and shared by every open dropdown, so treat
+        the chunks as read-only.
+        """
+
+        return self._derive("purchase_options", self._build_purchase_options)
+
+    def _build_purchase_options(self) -> list[list[discord.SelectOption]]:
+        options = []
+
+        for set_name, stock_set in self.sets.items():
+            if stock_set.total_quantity <= 0:
+                continue
+
+            if set_name != "":
+                options.append(
+                    discord.SelectOption(
+                        label=f"{set_name} Set",
+                        description=f"${stock_set.price:,}",
+                        value=f"{set_name} Set"
+                    )
+                )
+
+            for item in stock_set.items:
+                if item["quantity"] <= 0:
+                    continue
+
+                options.append(
+                    discord.SelectOption(
+                        label=f"{set_name} {item['name']}",
+                        description=f"${item['price']:,} | {item['quantity']} in stock",
+                        value=str(item["_id"])
+                    )
+                )
+
+        return split_list(options, 25)
+
+    def _derive(self, key: str, build):
+        if key not in self._derived:
+            self._derived[key] = build()
+
+        return self._derived[key]
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._derived.clear()
+
+        for listener in self._listeners:
+            listener()
+
+    def _apply(self, change: dict) -> None:
+        operation = change["operationType"]
+
+        if operation in ("insert", "update", "replace"):
+            item = change.get("fullDocument")
+            if item is None:
+                self.discard(change["documentKey"]["_id"])
+            else:
+                self.put(item)
+        elif operation == "delete":
+            self.discard(change["documentKey"]["_id"])
+
+    async def _watch(self) -> None:
+        while True:
+            try:
+                async with self.collection.watch(full_document="updateLookup") as stream:
+                    # Resync once the stream is open so nothing changed while it was down is missed.
+                    await self.load()
+
+                    async for change in stream:
+                        self._apply(change)
+            except OperationFailure as e:
+                _log.warning("Stock change stream unavailable, polling instead: %s", e)
+                break
+            except PyMongoError as e:
+                _log.warning("Stock change stream interrupted: %s", e)
+                await asyncio.sleep(5)
+
+        while True:
+            await asyncio.sleep(self.poll_interval)
+
+            try:
+                await self.load()
+            except PyMongoError as e:
+                _log.warning("Could not poll the stock collection: %s", e)
+
+
+class Cart:
+    """Items picked in one shop dropdown, priced from a catalog snapshot.
+
+    Prices are captured when the cart is created, so adding or removing items
+    only adjusts the running subtotal. The cart is checked against the live
+    catalog once, at checkout, by :meth:`revalidate`.
+    """
+
+    def __init__(self, catalog: StockCatalog):
+        self.catalog = catalog
+        self.items = catalog.snapshot
+        self.sets = catalog.sets
+        self.lines: list[ObjectId] = []
+        self.subtotal = 0
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    @property
+    def total(self) -> int:
+        return self.subtotal - calc_discount(self.subtotal, len(self.lines))
+
+    @property
+    def labels(self) -> list[str]:
+        return [f"{self.items[item_id].get('set', '')} {self.items[item_id]['name']}" for item_id in self.lines]
+
+    def add(self, item_id: ObjectId) -> None:
+        item = self.items.get(item_id)
+        if item is not None:
+            self.lines.append(item_id)
+            self.subtotal += item["price"]
+
+    def add_set(self, set_name: str) -> None:
+        stock_set = self.sets.get(set_name)
+        if stock_set is not None:
+            self.lines.extend(item["_id"] for item in stock_set.items)
+            self.subtotal += stock_set.price
+
+    def remove(self, item_id: ObjectId) -> None:
+        """Removes the most recently added unit of ``item_id``."""
+
+        for i in range(len(self.lines) - 1, -1, -1):
+            if self.lines[i] == item_id:
+                del self.lines[i]
+                self.subtotal -= self.items[item_id]["price"]
+                return
+
+    def pop(self) -> Stock | None:
+        """Removes and returns the most recently added item."""
+
+        if not self.lines:
+            return None
+
+        item = self.items[self.lines.pop()]
+        self.subtotal -= item["price"]
+        return item
+
+    def revalidate(self) -> bool:
+        """Reprices the cart from the live catalog, dropping items that no longer exist.
+
+        Returns whether the cart changed.
+        """
+
+        current = self.catalog.snapshot
+        if current is self.items:
+            return False
+
+        lines = [item_id for item_id in self.lines if item_id in current]
+        subtotal = sum(current[item_id]["price"] for item_id in lines)
+        changed = lines != self.lines or subtotal != self.subtotal
+
+        self.items = current
+        self.sets = self.catalog.sets
+        self.lines = lines
+        self.subtotal = subtotal
+        return changed
@@ -1,30 +1,56 @@
-from collections import defaultdict
+import asyncio
+from collections import Counter
 from datetime import datetime
 import locale
+import logging
+import time
 from typing import Optional
 
 import discord
 from bson import ObjectId
 from discord import app_commands as apc
 from discord.ext import commands, tasks
-from pymongo.collection import Collection
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorCollection
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
-from _types import Log, Stock, Ticket
+from _types import Customer, Log, Revenue, SalesCounter, Stock, StockBoard, Ticket
 from bot import Bot
 from constants import *
-from utils import write_to_ws
+from sheets import SheetRow
+from utils import ChannelNamePublisher, customer_rollup, embed_digest, revenue_formats, revenue_periods, tiers
+
+_log = logging.getLogger(__name__)
 
 locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
 def price_fmt(price): return locale.currency(price, grouping=True)
 
+def get_tier(total_spent: int) -> int:
+    return next((tier for threshold, tier in tiers if total_spent >= threshold), 0)
+
 class Accounting(commands.Cog):
     """Commands for accounting stock and payment logs."""
 
     def __init__(self, bot: Bot):
         self.bot = bot
+        self.stock_board: StockBoard = None
+        self.stock_board_lock = asyncio.Lock()
+        self.stock_changed = asyncio.Event()
+        self.stock_board_task: asyncio.Task = None
+        self.channel_names = ChannelNamePublisher()
+        self.export_reactions: set[asyncio.Task] = set()
         self.update_channels.start()
         self.update_stock_embed.start()
 
+    async def cog_load(self) -> None:
+        self.bot.catalog.add_listener(self.stock_changed.set)
+        self.stock_board_task = asyncio.create_task(self.stock_board_worker())
+
+    async def cog_unload(self) -> None:
+        self.bot.catalog.remove_listener(self.stock_changed.set)
+        self.stock_board_task.cancel()
+        self.channel_names.stop()
+
     item = apc.Group(name="item", description="Manages stock items")
     log = apc.Group(name="log", description="Manages logs")
 
@@ -50,9 +76,7 @@ class Accounting(commands.Cog):
         if not is_staff:
             raise Exception("You do not have permission to use this command.")
         
-        ticket_collection: Collection[Ticket] = interaction.client.database.get_collection("tickets")
-        filter = {"channel_id": interaction.channel_id}
-        ticket = ticket_collection.find_one(filter)
+        ticket = self.bot.open_tickets.get(interaction.channel_id)
 
         if ticket is None:
             raise Exception("No active ticket found.")
@@ -63,18 +87,18 @@ class Accounting(commands.Cog):
         subtotal = ticket["data"]["subtotal"]
         total = ticket["data"]["total"]
 
-        stock_collection: Collection[Stock] = self.bot.database.get_collection("stock")
         customer = interaction.guild.get_member(user_id)
-        items = [stock_collection.find_one({"_id": ObjectId(item_id)}) for item_id in item_ids if item_id != None]
+        item_ids = [ObjectId(item_id) for item_id in item_ids if item_id != None]
 
         purchase_log = await self.log_purchase(
             customer=customer,
             username=roblox,
             method=method,
-            items=items,
+            item_ids=item_ids,
             subtotal=subtotal,
             total=total - discount,
             info=info,
+            ticket=ticket,
         )
 
         embed = discord.Embed(
@@ -94,47 +118,140 @@ class Accounting(commands.Cog):
         customer: discord.Member,
         username: str,
         method: str,
-        items: list[Stock],
+        item_ids: list[ObjectId],
         subtotal: int,
         total: int,
-        info: str
+        info: str,
+        ticket: Optional[Ticket] = None,
     ) -> discord.Message:
-        """Logs a purchase and updates channel info."""
+        """Logs a purchase and updates channel info.
 
-        log_collection: Collection[Log] = self.bot.database.get_collection("logs")
-        stock_collection: Collection[Stock] = self.bot.database.get_collection("stock")
+        The items are resolved, the stock decremented and every log and
+        aggregate written inside one transaction, in a fixed number of
+        round trips regardless of how many items were bought. Stock the
+        ticket reserved at checkout is consumed instead of decremented again.
+        """
+
+        log_collection: AsyncIOMotorCollection = self.bot.database.get_collection("logs")
+        stock_collection: AsyncIOMotorCollection = self.bot.database.get_collection("stock")
+        ticket_collection: AsyncIOMotorCollection = self.bot.database.get_collection("tickets")
+        counter_collection: AsyncIOMotorCollection = self.bot.database.get_collection("counters")
+        customer_collection: AsyncIOMotorCollection = self.bot.database.get_collection("customers")
+        revenue_collection: AsyncIOMotorCollection = self.bot.database.get_collection("revenue")
         log_channel = self.bot.config.channels.purchases
 
         discount = subtotal - total
+        reserved = {ObjectId(id): quantity for id, quantity in (ticket or {}).get("data", {}).get("reserved", {}).items()}
 
-        item_names: list[str] = []
-        for item in items:
-            set = item.get("set", "")
-            name = item["name"]
-            price = item["price"]
+        items: list[Stock] = []
+        rows: list[SheetRow] = []
+        customer_data: Customer = None
 
-            stock_collection.update_one(item, {"$inc": {"quantity": -1}})
+        async def record(session: AsyncIOMotorClientSession) -> None:
+            nonlocal items, customer_data
+            rows.clear()
 
-            log = Log(user_id=customer.id, username=username, item=item, created_at=datetime.utcnow())
-            log[self.methods[method]] = info
+            now = datetime.utcnow()
+            quantities = Counter(item_ids)
 
-            item_names.append(f"{set} {name}")
-            log_collection.insert_one(log)
+            stock_items = stock_collection.find({"_id": {"$in": list(quantities)}}, session=session)
+            stock_by_id = {item["_id"]: item async for item in stock_items}
+            items = [stock_by_id[item_id] for item_id in item_ids if item_id in stock_by_id]
 
-            today = datetime.today()
-            recent_logs = log_collection.find({"created_at": {"$gte": today}})
-            new_total = sum([log["item"]["price"] for log in recent_logs])
+            if not items:
+                raise commands.BadArgument("None of the items in this ticket exist anymore.")
 
-            try:
-                itemized_discount = discount / len(items)
-                write_to_ws(new_total, username, customer.id, name, price - itemized_discount)
-                reaction = '\N{white heavy check mark}'
-            except:
-                reaction = '\N{cross mark}'
+            # Only the difference between what was bought and what was reserved still has to move.
+            decrements = [
+                UpdateOne({"_id": item_id}, {"$inc": {"quantity": reserved.get(item_id, 0) - quantities[item_id]}})
+                for item_id in quantities.keys() | reserved.keys()
+                if quantities[item_id] != reserved.get(item_id, 0)
+            ]
 
-        log_count = log_collection.count_documents({"user_id": customer.id})
-        user_logs = log_collection.find({"user_id": customer.id})
-        total_spent = sum([log["item"]["price"] for log in user_logs])
+            if decrements:
+                await stock_collection.bulk_write(decrements, ordered=False, session=session)
+
+            if reserved:
+                await ticket_collection.update_one(
+                    {"_id": ticket["_id"]},
+                    {"$unset": {"data.reserved": ""}},
+                    session=session,
+                )
+
+            logs = []
+            for item in items:
+                log = Log(user_id=customer.id, username=username, item=item, created_at=now)
+                log[self.methods[method]] = info
+                logs.append(log)
+
+            await log_collection.insert_many(logs, session=session)
+
+            earnings = sum(item["price"] for item in items)
+
+            day, *periods = revenue_periods(now)
+            revenue_update = {"$inc": {"total": earnings, "count": len(items)}}
+
+            day_revenue: Revenue = await revenue_collection.find_one_and_update(
+                {"_id": day},
+                revenue_update,
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+            await revenue_collection.bulk_write(
+                [UpdateOne({"_id": period}, revenue_update, upsert=True) for period in periods],
+                session=session,
+            )
+
+            # Running day total after each item, as the sheet shows it.
+            day_total = day_revenue["total"] - earnings
+            itemized_discount = discount / len(items)
+            for item in items:
+                day_total += item["price"]
+                rows.append(SheetRow(
+                    created_at=now,
+                    username=username,
+                    user_id=customer.id,
+                    item=item["name"],
+                    price=item["price"] - itemized_discount,
+                    day_total=day_total,
+                ))
+
+            await counter_collection.update_one(
+                {"_id": "sales"},
+                {"$inc": {"count": len(items), "earnings": earnings}},
+                upsert=True,
+                session=session,
+            )
+
+            customer_data = await customer_collection.find_one_and_update(
+                {"_id": customer.id},
+                {
+                    "$inc": {"total_spent": earnings, "transaction_count": len(items)},
+                    "$set": {"last_purchase_at": now},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                session=session,
+            )
+
+            tier = get_tier(customer_data["total_spent"])
+            if customer_data.get("tier") != tier:
+                await customer_collection.update_one({"_id": customer.id}, {"$set": {"tier": tier}}, session=session)
+                customer_data["tier"] = tier
+
+        async with await self.bot.database.client.start_session() as session:
+            await session.with_transaction(record)
+
+        if reserved:
+            ticket["data"].pop("reserved", None)
+
+        exports = [self.bot.sheet_exporter.submit(row) for row in rows]
+
+        item_names = [f"{item.get('set', '')} {item['name']}" for item in items]
+
+        log_count = customer_data["transaction_count"]
+        total_spent = customer_data["total_spent"]
 
         discount_tag = f" (-{price_fmt(discount)})" if discount > 0 else ""
 
@@ -152,25 +269,38 @@ class Accounting(commands.Cog):
         customer_role = self.bot.config.roles.customer
         await customer.add_roles(customer_role)
 
-        tier_role = None
-        if total_spent >= 100:
-            tier_role = self.bot.config.roles.tier1
-        if total_spent >= 250:
-            tier_role = self.bot.config.roles.tier2
-        if total_spent >= 500:
-            tier_role = self.bot.config.roles.tier3
-        if total_spent >= 1000:
-            tier_role = self.bot.config.roles.tier4
-        if total_spent >= 1500:
-            tier_role = self.bot.config.roles.tier5
-
-        if tier_role:
+        tier = customer_data["tier"]
+        if tier:
+            tier_role = getattr(self.bot.config.roles, f"tier{tier}")
             await customer.add_roles(tier_role, reason=f"Spent ${total_spent:,}")
 
         message = await log_channel.send(embed=log_embed)
-        await message.add_reaction(reaction)
+        # Keep a reference so the task is not garbage collected before it reacts.
+        task = asyncio.create_task(self.add_export_reaction(message, exports))
+        self.export_reactions.add(task)
+        task.add_done_callback(self.export_reactions.discard)
+        await self.publish_counters()
         return message
 
+    async def get_revenue(self, when: Optional[datetime] = None) -> dict[str, int]:
+        """Returns the day, week and month revenue totals containing ``when`` (UTC)."""
+
+        revenue_collection: AsyncIOMotorCollection = self.bot.database.get_collection("revenue")
+        day, week, month = revenue_periods(when or datetime.utcnow())
+
+        totals = {period: 0 for period in (day, week, month)}
+        async for revenue in revenue_collection.find({"_id": {"$in": list(totals)}}):
+            totals[revenue["_id"]] = revenue["total"]
+
+        return {"day": totals[day], "week": totals[week], "month": totals[month]}
+
+    async def add_export_reaction(self, message: discord.Message, exports: list[asyncio.Future]) -> None:
+        """Reacts to a purchase log once its spreadsheet rows have been exported."""
+
+        results = await asyncio.gather(*exports)
+        reaction = '\N{white heavy check mark}' if all(results) else '\N{cross mark}'
+        await message.add_reaction(reaction)
+
     @log.command()
     @apc.guild_only()
     async def scam(
@@ -252,6 +382,51 @@ class Accounting(commands.Cog):
 
         await interaction.followup.send(embed=embed)
 
+    @log.command()
+    @apc.guild_only()
+    async def backfill(self, interaction: discord.Interaction) -> None:
+        """Rebuilds the sales counters, customer totals and revenue rollups from the purchase logs."""
+
+        await interaction.response.defer(ephemeral=True)
+
+        is_owner = interaction.user.id in self.bot.config.owner_ids
+        if not is_owner:
+            raise Exception("You do not have permission to use this command.")
+
+        log_collection: AsyncIOMotorCollection = self.bot.database.get_collection("logs")
+        counter_collection: AsyncIOMotorCollection = self.bot.database.get_collection("counters")
+
+        pipeline = [{"$group": {"_id": None, "count": {"$sum": 1}, "earnings": {"$sum": "$item.price"}}}]
+        totals = await log_collection.aggregate(pipeline).to_list(length=1)
+        totals = totals[0] if totals else {"count": 0, "earnings": 0}
+
+        await counter_collection.update_one(
+            {"_id": "sales"},
+            {"$set": {"count": totals["count"], "earnings": totals["earnings"]}},
+            upsert=True,
+        )
+
+        pipeline = customer_rollup("replace")
+        await log_collection.aggregate(pipeline).to_list(length=None)
+
+        for period_format in revenue_formats:
+            pipeline = [
+                {"$match": {"created_at": {"$exists": True}}},
+                {
+                    "$group": {
+                        "_id": {"$dateToString": {"format": period_format, "date": "$created_at"}},
+                        "total": {"$sum": "$item.price"},
+                        "count": {"$sum": 1},
+                    }
+                },
+                {"$merge": {"into": "revenue", "whenMatched": "replace"}},
+            ]
+            await log_collection.aggregate(pipeline).to_list(length=None)
+
+        await interaction.followup.send(
+            f"Backfilled `{totals['count']:,}` sales totalling `${totals['earnings']:,}`.", ephemeral=True
+        )
+
     @commands.hybrid_command()
     @commands.guild_only()
     async def stock(self, ctx: commands.Context) -> None:
@@ -285,18 +460,27 @@ class Accounting(commands.Cog):
         if not is_staff:
             raise Exception("You do not have permission to use this command.")
 
-        stock_collection: Collection[Stock] = self.bot.database.get_collection("stock")
-        stock_item = stock_collection.find_one({"_id": ObjectId(item)})
+        stock_collection: AsyncIOMotorCollection = self.bot.database.get_collection("stock")
+        stock_item = self.bot.catalog.get(item)
+
+        if stock_item is None:
+            raise commands.BadArgument("This item does not exist.")
+
+        stock_item = await stock_collection.find_one_and_update(
+            {"_id": stock_item["_id"]},
+            {"$inc": {"quantity": quantity}},
+            return_document=ReturnDocument.AFTER,
+        )
 
         if stock_item is None:
             raise commands.BadArgument("This item does not exist.")
 
+        self.bot.catalog.put(stock_item)
+
         set = stock_item.get("set", "")
         name = stock_item["name"]
         price = stock_item["price"]
-        combined_quantity = stock_item["quantity"] + quantity
-
-        stock_collection.update_one(stock_item, {"$inc": {"quantity": quantity}})
+        combined_quantity = stock_item["quantity"]
 
         restock_embed = discord.Embed(
             color=0x77ABFC,
@@ -320,9 +504,9 @@ class Accounting(commands.Cog):
         if not is_owner:
             raise Exception("You do not have permission to use this command.")
 
-        stock_collection: Collection[Stock] = self.bot.database.get_collection("stock")
-        for stock_item in stock_collection.find():
-            stock_collection.update_one(stock_item, {"$set": {"quantity": 0}})
+        stock_collection: AsyncIOMotorCollection = self.bot.database.get_collection("stock")
+        await stock_collection.update_many({}, {"$set": {"quantity": 0}})
+        await self.bot.catalog.load()
 
         await interaction.followup.send("Cleared the stock.", ephemeral=True)
 
@@ -343,10 +527,9 @@ class Accounting(commands.Cog):
         if not is_owner:
             raise Exception("You do not have permission to use this command.")
 
-        stock_collection: Collection[Stock] = self.bot.database.get_collection("stock")
-        for stock_item in stock_collection.find():
-            stock_collection.update_one(
-                stock_item, {"$set": {"quantity": amount}})
+        stock_collection: AsyncIOMotorCollection = self.bot.database.get_collection("stock")
+        await stock_collection.update_many({}, {"$set": {"quantity": amount}})
+        await self.bot.catalog.load()
 
         await interaction.followup.send(f"Filled the stock with `{amount}` per item.", ephemeral=True)
 
@@ -373,14 +556,15 @@ class Accounting(commands.Cog):
         if not is_owner:
             raise Exception("You do not have permission to use this command.")
 
-        stock_collection: Collection[Stock] = self.bot.database.get_collection("stock")
-        stock_item = stock_collection.find_one({"set": set, "name": name})
+        stock_collection: AsyncIOMotorCollection = self.bot.database.get_collection("stock")
+        stock_item = Stock(set=set, name=name, price=price, quantity=quantity)
 
-        if stock_item is not None:
+        try:
+            await stock_collection.insert_one(stock_item)
+        except DuplicateKeyError:
             raise commands.BadArgument("This item already exists.")
 
-        stock_item = Stock(set=set, name=name, price=price, quantity=quantity)
-        stock_collection.insert_one(stock_item)
+        self.bot.catalog.put(stock_item)
 
         item_embed = discord.Embed(
             color=0x77ABFC,
@@ -428,8 +612,8 @@ class Accounting(commands.Cog):
         if not is_owner:
             raise Exception("You do not have permission to use this command.")
 
-        stock_collection: Collection[Stock] = self.bot.database.get_collection("stock")
-        stock_item = stock_collection.find_one({"_id": ObjectId(item)})
+        stock_collection: AsyncIOMotorCollection = self.bot.database.get_collection("stock")
+        stock_item = self.bot.catalog.get(item)
 
         if stock_item is None:
             raise commands.BadArgument("This item does not exist.")
@@ -473,7 +657,8 @@ class Accounting(commands.Cog):
         if quantity is not None:
             new_item["quantity"] = quantity
 
-        stock_collection.update_one(stock_item, {"$set": new_item})
+        await stock_collection.update_one({"_id": stock_item["_id"]}, {"$set": new_item})
+        self.bot.catalog.put(new_item)
         await interaction.followup.send(embed=item_embed)
 
     @item.command()
@@ -493,8 +678,8 @@ class Accounting(commands.Cog):
         if not is_owner:
             raise Exception("You do not have permission to use this command.")
 
-        stock_collection: Collection[Stock] = self.bot.database.get_collection("stock")
-        stock_item = stock_collection.find_one({"_id": ObjectId(item)})
+        stock_collection: AsyncIOMotorCollection = self.bot.database.get_collection("stock")
+        stock_item = self.bot.catalog.get(item)
 
         if stock_item is None:
             raise commands.BadArgument("This item does not exist.")
@@ -503,7 +688,8 @@ class Accounting(commands.Cog):
         name = stock_item["name"]
         price = stock_item["price"]
 
-        stock_collection.delete_one(stock_item)
+        await stock_collection.delete_one({"_id": stock_item["_id"]})
+        self.bot.catalog.discard(stock_item["_id"])
 
         remove_item_embed = discord.Embed(
             color=0x77ABFC,
@@ -534,49 +720,15 @@ class Accounting(commands.Cog):
     async def stock_autocompletion(self, interaction: discord.Interaction, current: str) -> list[apc.Choice[str]]:
         """Autocompletes stock items."""
 
-        stock_collection: Collection[Stock] = self.bot.database.get_collection("stock")
-
-        choices = []
-        for item in stock_collection.find().sort("name"):
-            objectId = item["_id"]
-            set_name = item.get("set", "")
-            name = item["name"]
-            price = item["price"]
-            quantity = item["quantity"]
-
-            if current.lower() in f"{set_name} {name}".strip().lower():
-                display_item = f"{set_name} {name} (${price})"
-                if quantity < 1:
-                    choices.append(apc.Choice(name=f"{display_item} | Out of Stock", value=str(objectId)))
-                else:
-                    choices.append(apc.Choice(name=f"{display_item} | Stock: {quantity}", value=str(objectId)))
-
-        return choices[:25]
+        return self.bot.catalog.search(current)
             
-    def create_stock_embed(self):
-        stock_collection: Collection[Stock] = self.bot.database.get_collection("stock")
-        sets = defaultdict(lambda: {"price": 0, "items": []})
-
+    def create_stock_embed(self) -> discord.Embed:
         stock_embed = discord.Embed(color=0x77ABFC, title="Bry's Shop Stock", timestamp=discord.utils.utcnow())
         stock_embed.set_footer(text="Last Updated")
-        
-        for stock_item in stock_collection.find().sort("set"):
-            set_name = stock_item.get("set") or "Other"
-            price = stock_item["price"]
-
-            sets[set_name]["price"] += price
-            sets[set_name]["items"].append(stock_item)
-
-        for set_name, data in sets.items():
-            name = stock_item["name"]
-            price = stock_item["price"]
-            quantity = stock_item["quantity"]
-
-            items: list[Stock] = data["items"]
-            items.sort(key=lambda x: x["price"])
 
+        for set_name, stock_set in self.bot.catalog.sets.items():
             field_value = ""
-            for item in items:
+            for item in stock_set.items:
                 name = item["name"]
                 price = item["price"]
                 quantity = item["quantity"]
@@ -588,48 +740,114 @@ class Accounting(commands.Cog):
                 else:
                     field_value += f"\n- {field_template} ` Out of Stock `"
 
-            stock_embed.add_field(name=set_name, value=field_value, inline=False)
+            stock_embed.add_field(name=set_name or "Other", value=field_value, inline=False)
 
-        stock_embed._fields.append(stock_embed._fields.pop(0))
         return stock_embed
 
     @tasks.loop(minutes=10)
     async def update_channels(self) -> None:
         """Updates the sales and earnings channels."""
 
+        await self.publish_counters()
+
+    async def publish_counters(self) -> None:
+        """Queues the sales and earnings channel names for renaming.
+
+        Renames go through a :class:`ChannelNamePublisher`, so unchanged names
+        are skipped and this never waits on Discord's rename limit.
+        """
+
         sales_channel = self.bot.config.channels.sales
         earnings_channel = self.bot.config.channels.earnings
 
-        log_collection: Collection[Log] = self.bot.database.get_collection("logs")
-        logs = log_collection.find()
+        counter_collection: AsyncIOMotorCollection = self.bot.database.get_collection("counters")
+        counter: SalesCounter = await counter_collection.find_one({"_id": "sales"}) or {}
 
         # Don't touch!
         starting_sales = 99
 
-        combined_sales = starting_sales + log_collection.count_documents({})
-        combined_earnings = sum([log["item"]["price"] for log in logs])
+        combined_sales = starting_sales + counter.get("count", 0)
+        combined_earnings = counter.get("earnings", 0)
 
-        await sales_channel.edit(name=f"Sales: {combined_sales:,}")
-        await earnings_channel.edit(name=f"Earned: ${combined_earnings:,}")
+        self.channel_names.publish(sales_channel, f"Sales: {combined_sales:,}")
+        self.channel_names.publish(earnings_channel, f"Earned: ${combined_earnings:,}")
 
     @tasks.loop(minutes=10)
     async def update_stock_embed(self) -> None:
         """Updates the stock embed."""
 
+        await self.publish_stock_board()
+
+    async def stock_board_worker(self) -> None:
+        """Republishes the stock board shortly after the catalog changes.
+
+        Changes are coalesced for a couple of seconds, and edits are spaced at
+        least ``STOCK_BOARD_WINDOW`` seconds apart, so a burst of restocks ends
+        up as a single edit.
+        """
+
+        await self.bot.wait_until_ready()
+        last_published = 0.0
+
+        while True:
+            await self.stock_changed.wait()
+            await asyncio.sleep(max(2.0, last_published + STOCK_BOARD_WINDOW - time.monotonic()))
+            self.stock_changed.clear()
+
+            try:
+                await self.publish_stock_board()
+            except Exception as e:
+                _log.warning("Could not publish the stock board: %s", e)
+
+            last_published = time.monotonic()
+
+    async def publish_stock_board(self) -> None:
+        """Publishes the stock embed to the shop channel unless it is unchanged.
+
+        The board's message ID and the digest of its last published embed are
+        kept in the ``state`` collection. The channel history is only scanned
+        when the stored message has gone missing.
+        """
+
+        async with self.stock_board_lock:
+            await self._publish_stock_board()
+
+    async def _publish_stock_board(self) -> None:
+        state_collection: AsyncIOMotorCollection = self.bot.database.get_collection("state")
         stock_channel = self.bot.config.channels.shop
+
+        if self.stock_board is None:
+            self.stock_board = await state_collection.find_one({"_id": "stock_board"}) or StockBoard(_id="stock_board")
+
         stock_embed = self.create_stock_embed()
-        stock_embed.set_footer(text="Last Updated")
+        digest = embed_digest(stock_embed)
+
+        message_id = self.stock_board.get("message_id")
+        if self.stock_board.get("channel_id") != stock_channel.id:
+            message_id = None
+
+        if message_id is not None and self.stock_board.get("digest") == digest:
+            return
 
         stock_message = None
-        async for message in stock_channel.history():
-            if message.author == message.guild.me:
-                stock_message = message
-                break
+        if message_id is not None:
+            try:
+                stock_message = await stock_channel.get_partial_message(message_id).edit(embed=stock_embed)
+            except discord.NotFound:
+                stock_message = None
 
         if stock_message is None:
-            await stock_channel.send(embed=stock_embed)
-        else:
-            await stock_message.edit(embed=stock_embed)
+            async for message in stock_channel.history():
+                if message.author == message.guild.me:
+                    stock_message = await message.edit(embed=stock_embed)
+                    break
+
+        if stock_message is None:
+            stock_message = await stock_channel.send(embed=stock_embed)
+
+        update = {"channel_id": stock_channel.id, "message_id": stock_message.id, "digest": digest}
+        await state_collection.update_one({"_id": "stock_board"}, {"$set": update}, upsert=True)
+        self.stock_board.update(update)
 
     @update_channels.before_loop
     @update_stock_embed.before_loop
@@ -7,9 +7,9 @@ from bot import Bot
 from views.payment import ConfirmationView
 from typing import Optional
 
-from pymongo.collection import Collection
+from motor.motor_asyncio import AsyncIOMotorCollection
 
-from _types import Log
+from _types import Customer
 
 locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
 price_fmt = lambda price: locale.currency(price, grouping=True)
@@ -51,11 +51,11 @@ class Info(commands.Cog):
         if user is None:
             user = ctx.author._user
 
-        log_collection: Collection[Log] = self.bot.database.get_collection("logs")
+        customer_collection: AsyncIOMotorCollection = self.bot.database.get_collection("customers")
+        customer: Customer = await customer_collection.find_one({"_id": user.id}) or {}
 
-        log_count = log_collection.count_documents({"user_id": user.id})
-        user_logs = log_collection.find({"user_id": user.id})
-        total_spent = sum([log["item"]["price"] for log in user_logs])
+        log_count = customer.get("transaction_count", 0)
+        total_spent = customer.get("total_spent", 0)
 
         embed = discord.Embed(
             color=0x77ABFC,
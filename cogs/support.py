@@ -1,11 +1,12 @@
+from typing import Optional
+
 import discord
 from discord import app_commands as apc
 from discord.ext import commands
-from pymongo.collection import Collection
 
-from _types import Ticket
 from bot import Bot
 from constants import *
+from transcripts import transcript_url
 from views.tickets import PurchasePanel, SupportPanel
 
 class Support(commands.Cog):
@@ -14,6 +15,36 @@ class Support(commands.Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
 
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        """Records the ticket channels that already exist."""
+
+        for guild in self.bot.guilds:
+            await self.bot.ticket_channels.warm(guild)
+
+        await self.bot.ticket_messages.catch_up(self.bot)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel) -> None:
+        await self.bot.ticket_channels.channel_created(channel)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel) -> None:
+        await self.bot.ticket_channels.channel_deleted(channel)
+        self.bot.ticket_messages.untrack(channel.id)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message) -> None:
+        await self.bot.ticket_messages.record(message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        await self.bot.ticket_messages.edited(payload)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        await self.bot.ticket_messages.deleted(payload)
+
     ticket = apc.Group(name="ticket", description="Ticket commands")
     purchase = apc.Group(name="purchase", description="Purchase commands")
     support = apc.Group(name="support", description="Support commands")
@@ -91,10 +122,7 @@ class Support(commands.Cog):
         if not is_staff:
             raise Exception("You do not have permission to use this command.")
 
-        ticket_collection: Collection[Ticket] = interaction.client.database.get_collection("tickets")
-
-        filter = {"channel_id": interaction.channel_id}
-        ticket = ticket_collection.find_one(filter)
+        ticket = self.bot.open_tickets.get(interaction.channel_id)
 
         if ticket == None:
             raise Exception("This channel is not a ticket.")
@@ -135,10 +163,7 @@ class Support(commands.Cog):
         if not is_staff:
             raise Exception("You do not have permission to use this command.")
 
-        ticket_collection: Collection[Ticket] = interaction.client.database.get_collection("tickets")
-
-        filter = {"channel_id": interaction.channel_id}
-        ticket = ticket_collection.find_one(filter)
+        ticket = self.bot.open_tickets.get(interaction.channel_id)
 
         if ticket == None:
             raise Exception("This channel is not a ticket.")
@@ -182,10 +207,7 @@ class Support(commands.Cog):
         if not is_staff:
             raise Exception("You do not have permission to use this command.")
 
-        ticket_collection: Collection[Ticket] = interaction.client.database.get_collection("tickets")
-
-        filter = {"channel_id": interaction.channel_id}
-        ticket = ticket_collection.find_one(filter)
+        ticket = self.bot.open_tickets.get(interaction.channel_id)
 
         if ticket == None:
             raise Exception("This channel is not a ticket.")
@@ -212,5 +234,58 @@ class Support(commands.Cog):
 
         await interaction.followup.send(embed=embed)
 
+    @ticket.command()
+    @apc.guild_only()
+    async def search(self, interaction: discord.Interaction, query: str, category: Optional[str] = None) -> None:
+        """Searches closed ticket transcripts.
+        
+        Parameters
+        ----------
+        query : str
+            The words to search for.
+        category : Optional[str]
+            Only search tickets in this category, e.g. Purchase.
+        """
+
+        await interaction.response.defer(ephemeral=True)
+
+        is_staff = self.bot.config.roles.staff in interaction.user.roles
+        if not is_staff:
+            raise Exception("You do not have permission to use this command.")
+
+        hits = await self.bot.transcript_index.search(query, category)
+
+        embed = discord.Embed(color=0x599ae0)
+
+        embed.set_author(
+            name=f"Transcript Search",
+            icon_url=ICONS.ticket
+        )
+
+        embed.set_footer(
+            text=interaction.guild,
+            icon_url=interaction.guild.icon
+        )
+
+        if not hits:
+            embed.description = "No transcripts matched your search."
+
+        for hit in hits:
+            closed_at = hit.closed_at[:10] or "Unknown"
+            header = f"Creator: {hit.creator} | Closed: {closed_at}"
+            link = f"[View Transcript]({transcript_url(hit.channel_id)})"
+
+            # Fields hold 1024 characters, so only the snippet is shortened and the link survives.
+            room = 1024 - len(header) - len(link) - 2
+            snippet = hit.snippet if len(hit.snippet) <= room else hit.snippet[:room - 3] + "..."
+
+            embed.add_field(
+                name=f"{hit.name} ({hit.category})",
+                value=f"{header}\n{snippet}\n{link}",
+                inline=False,
+            )
+
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
 async def setup(bot: Bot):
     await bot.add_cog(Support(bot))
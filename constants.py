@@ -20,5 +20,8 @@ class Emojis:
 
 IS_PROD = os.getenv("ENV") == "prod"
 
+# Minimum seconds between event-driven stock board edits.
+STOCK_BOARD_WINDOW = float(os.getenv("STOCK_BOARD_WINDOW", 15))
+
 ICONS = Icons()
 EMOJIS = Emojis()
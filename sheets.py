@@ -0,0 +1,272 @@
+import asyncio
+import locale
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+from constants import *
+from utils import fetch_roblox_id
+
+locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+
+_log = logging.getLogger(__name__)
+
+header_styles = {
+    "backgroundColor": {
+        "red": 0.92,
+        "green": 0.82,
+        "blue": 0.86,
+    },
+    "horizontalAlignment": "CENTER",
+    "textFormat": {
+        "fontSize": 12,
+        "bold": True,
+    }
+}
+
+row_styles = {
+    "backgroundColor": {
+        "red": 1,
+        "green": 1,
+        "blue": 1,
+    },
+    "horizontalAlignment": "CENTER",
+    "textFormat": {
+        "fontSize": 10,
+    }
+}
+
+header_row = ["Date", "User", "Customer (Roblox ID)", "Discord ID", "Item", "Amount", "Total Cost"]
+
+# Columns B, E, F and G are bold on purchase rows, the rest are not.
+row_formats = [
+    {**row_styles, "textFormat": {"bold": bold}}
+    for bold in (False, True, False, False, True, True, True)
+]
+
+
+@dataclass
+class SheetRow:
+    created_at: datetime
+    username: str
+    user_id: int
+    item: str
+    price: float
+    day_total: int
+    roblox_id: int | str | None = field(default=None, repr=False)
+
+    @property
+    def date(self) -> str:
+        return self.created_at.strftime('%m/%d/%y')
+
+    @property
+    def values(self) -> list[str]:
+        display_price = locale.currency(self.price, grouping=True)
+        return [self.date, self.username, str(self.roblox_id or ""), str(self.user_id), self.item, display_price, ""]
+
+
+def _cells(sheet_id: int, row: int, column: int, values: list[str], formats: list[dict] = None) -> dict:
+    """Builds an ``updateCells`` request writing one row of values (and formats) at a 1-based row."""
+
+    cells = []
+    for i, value in enumerate(values):
+        cell = {"userEnteredValue": {"stringValue": value}}
+        if formats is not None:
+            cell["userEnteredFormat"] = formats[i]
+        cells.append(cell)
+
+    return {
+        "updateCells": {
+            "rows": [{"values": cells}],
+            "fields": "userEnteredValue" if formats is None else "userEnteredValue,userEnteredFormat",
+            "start": {"sheetId": sheet_id, "rowIndex": row - 1, "columnIndex": column - 1},
+        }
+    }
+
+
+class SheetSession:
+    """Long-lived handle on the purchases worksheet.
+
+    Authorizes once and keeps the next free row, the current "Date" header row
+    and the date of the last written row in memory, so a write never has to
+    download the sheet. The state is only resynced from the sheet when the
+    session opens or when a write finds the sheet changed underneath it.
+    """
+
+    scope = ['https://spreadsheets.google.com/feeds',
+             'https://www.googleapis.com/auth/drive']
+
+    def __init__(self, key: str, credentials_file: str = 'credentials.json'):
+        self.key = key
+        self.credentials_file = credentials_file
+        self.client: gspread.Client = None
+        self.spreadsheet: gspread.Spreadsheet = None
+        self.worksheet: gspread.Worksheet = None
+        self.next_row = 1
+        self.row_count = 0
+        self.header_row = 0
+        self.last_date: str = None
+
+    def open(self) -> None:
+        credentials = ServiceAccountCredentials.from_json_keyfile_name(
+            self.credentials_file, self.scope)
+
+        self.client = gspread.authorize(credentials)
+        self.spreadsheet = self.client.open_by_key(self.key)
+        self.sync()
+
+    def authorize(self) -> None:
+        """Opens the session on first use and refreshes the access token once it expires."""
+
+        if self.client is None:
+            self.open()
+        elif not self.client.auth.valid:
+            self.client.login()
+
+    def sync(self) -> None:
+        """Reloads the row state from the date column of the sheet."""
+
+        self.worksheet = self.spreadsheet.get_worksheet(0)
+        dates = self.worksheet.col_values(1)
+
+        self.next_row = len(dates) + 1
+        self.row_count = self.worksheet.row_count
+        self.last_date = dates[-1] if dates else None
+        self.header_row = max((i for i, value in enumerate(dates, start=1) if value == "Date"), default=0)
+
+    def is_current(self) -> bool:
+        """Checks that nobody has written below the last row this session knows of."""
+
+        if self.next_row == 1:
+            return not self.worksheet.get("A1")
+
+        values = self.worksheet.get(f"A{self.next_row - 1}:A{self.next_row}")
+        return values == [[self.last_date]]
+
+    def write(self, rows: list[SheetRow]) -> None:
+        self.authorize()
+
+        if not self.is_current():
+            _log.info("Worksheet changed since the last export, resyncing.")
+            self.sync()
+
+        sheet_id = self.worksheet.id
+        next_row = self.next_row
+        current_header = self.header_row
+        last_date = self.last_date
+
+        requests = []
+        totals = {}
+
+        for row in rows:
+            if row.date != last_date:
+                requests.append(_cells(sheet_id, next_row, 1, header_row, [header_styles] * len(header_row)))
+                current_header = next_row
+                last_date = row.date
+                next_row += 1
+
+            requests.append(_cells(sheet_id, next_row, 1, row.values, row_formats))
+            totals[current_header] = row.day_total
+            next_row += 1
+
+        for header, total in totals.items():
+            if header:
+                requests.append(_cells(sheet_id, header, 7, [locale.currency(total, grouping=True)]))
+
+        missing_rows = next_row - 1 - self.row_count
+        if missing_rows > 0:
+            requests.insert(0, {"appendDimension": {"sheetId": sheet_id, "dimension": "ROWS", "length": missing_rows}})
+
+        try:
+            self.spreadsheet.batch_update({"requests": requests})
+        except gspread.exceptions.APIError:
+            self.sync()
+            raise
+
+        self.next_row = next_row
+        self.row_count = max(self.row_count, next_row - 1)
+        self.header_row = current_header
+        self.last_date = last_date
+
+
+class SheetExporter:
+    """Background worker that coalesces purchase rows into batched spreadsheet writes.
+
+    Rows submitted within ``window`` seconds of each other are written with a
+    single ``batch_update`` carrying both values and formatting. Failed batches
+    are retried with exponential backoff up to ``max_attempts`` times.
+    """
+
+    def __init__(self, session: SheetSession, window: float = 2.0, max_attempts: int = 5):
+        self.session = session
+        self.window = window
+        self.max_attempts = max_attempts
+        self.queue: asyncio.Queue[tuple[SheetRow, asyncio.Future]] = asyncio.Queue()
+        self._task: asyncio.Task = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def submit(self, row: SheetRow) -> asyncio.Future:
+        """Queues a row for export. The returned future resolves to whether it was written."""
+
+        future = asyncio.get_running_loop().create_future()
+
+        if not IS_PROD:
+            future.set_result(True)
+        else:
+            self.queue.put_nowait((row, future))
+
+        return future
+
+    async def _run(self) -> None:
+        if IS_PROD:
+            try:
+                await asyncio.to_thread(self.session.open)
+            except Exception as e:
+                _log.warning("Could not open the purchases sheet: %s", e)
+
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(self.window)
+
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[SheetRow, asyncio.Future]]) -> None:
+        rows = [row for row, _ in batch]
+        success = False
+
+        for row in rows:
+            if row.roblox_id is None:
+                row.roblox_id = await asyncio.to_thread(fetch_roblox_id, row.username) or ""
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await asyncio.to_thread(self.session.write, rows)
+            except Exception as e:
+                _log.warning("Sheet export of %d rows failed (attempt %d): %s", len(rows), attempt, e)
+
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(2 ** attempt)
+            else:
+                success = True
+                break
+
+        if not success:
+            _log.error("Dropped %d rows after %d failed sheet exports.", len(rows), self.max_attempts)
+
+        for _, future in batch:
+            if not future.done():
+                future.set_result(success)
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web
+from utils import write_compressed
+
+data = bytes(range(256)) * 19 + b"x" * 149  # 5013 bytes
+size = len(data)
+
+
+@pytest.fixture(autouse=True)
+def volume(tmp_path, monkeypatch):
+    monkeypatch.setenv("RAILWAY_VOLUME_MOUNT_PATH", str(tmp_path))
+    monkeypatch.setattr(web, "transcript_cache", web.TranscriptCache(1024 * 1024))
+    write_compressed(str(tmp_path / "transcript-42.html.gz"), data)
+
+
+def get(headers: dict):
+    async def request():
+        response = await web.app.test_client().get("/view?channel_id=42", headers=headers)
+        return response, await response.get_data()
+
+    return asyncio.run(request())
+
+
+@pytest.mark.parametrize(
+    ("header", "start", "stop"),
+    [
+        ("bytes=0-9", 0, 10),
+        ("bytes=-1", size - 1, size),
+        ("bytes=-5013", 0, size),
+        ("bytes=5012-5012", size - 1, size),
+        ("bytes=5000-", 5000, size),
+        ("bytes=10-99999", 10, size),
+    ],
+)
+def test_single_range(header, start, stop):
+    response, body = get({"Range": header})
+
+    assert response.status_code == 206
+    assert body == data[start:stop]
+    assert response.headers["Content-Range"] == f"bytes {start}-{stop - 1}/{size}"
+
+
+def test_unsatisfiable_range():
+    response, body = get({"Range": "bytes=6000-"})
+
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{size}"
+
+
+def test_full_body_and_not_modified():
+    response, body = get({})
+    assert response.status_code == 200
+    assert body == data
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+    response, body = get({"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert body == b""
+
+
+def test_stale_if_range_gets_full_body():
+    response, body = get({"Range": "bytes=0-9", "If-Range": '"stale"'})
+
+    assert response.status_code == 200
+    assert body == data
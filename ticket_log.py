@@ -0,0 +1,207 @@
+import html
+import logging
+
+import discord
+from discord.ext import commands
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from _types import TicketMessage
+
+_log = logging.getLogger(__name__)
+
+
+def _attachments(attachments: list[dict]) -> list[dict]:
+    return [
+        {
+            "filename": attachment["filename"],
+            "url": attachment["url"],
+            "content_type": attachment.get("content_type"),
+            "size": attachment.get("size", 0),
+        }
+        for attachment in attachments
+    ]
+
+
+class TicketMessageStore:
+    """Captures ticket channel messages as they are sent, edited and deleted.
+
+    Each message of a tracked ticket is one document in ``ticket_messages``,
+    so a transcript can be rendered from the store without fetching the channel
+    history. Tickets are tracked from creation until their channel is deleted.
+    Messages sent while the bot was offline are picked up by :meth:`catch_up`.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self.collection = collection
+        self.channels: set[int] = set()
+
+    async def load(self, ticket_collection: AsyncIOMotorCollection) -> None:
+        """Tracks every open ticket that has been captured since it was created."""
+
+        async for ticket in ticket_collection.find({"open": True, "captured": True}, {"channel_id": 1}):
+            self.channels.add(ticket["channel_id"])
+
+    def track(self, channel_id: int) -> None:
+        self.channels.add(channel_id)
+
+    def untrack(self, channel_id: int) -> None:
+        self.channels.discard(channel_id)
+
+    async def record(self, message: discord.Message) -> None:
+        if message.channel.id not in self.channels:
+            return
+
+        document: TicketMessage = {
+            "_id": message.id,
+            "channel_id": message.channel.id,
+            "author_id": message.author.id,
+            "author": str(message.author),
+            "avatar_url": message.author.display_avatar.url,
+            "bot": message.author.bot,
+            "content": message.content,
+            "embeds": [embed.to_dict() for embed in message.embeds],
+            "attachments": _attachments([attachment.to_dict() for attachment in message.attachments]),
+            "created_at": message.created_at,
+        }
+
+        if message.edited_at is not None:
+            document["edited_at"] = message.edited_at
+
+        await self.collection.replace_one({"_id": message.id}, document, upsert=True)
+
+    async def edited(self, payload: discord.RawMessageUpdateEvent) -> None:
+        if payload.channel_id not in self.channels:
+            return
+
+        data = payload.data
+        update = {}
+
+        if "content" in data:
+            update["content"] = data["content"]
+        if "embeds" in data:
+            update["embeds"] = data["embeds"]
+        if "attachments" in data:
+            update["attachments"] = _attachments(data["attachments"])
+        if data.get("edited_timestamp"):
+            update["edited_at"] = discord.utils.parse_time(data["edited_timestamp"])
+
+        if update:
+            await self.collection.update_one({"_id": payload.message_id}, {"$set": update})
+
+    async def deleted(self, payload: discord.RawMessageDeleteEvent) -> None:
+        # Deleted messages are kept and marked, so transcripts still show them.
+        if payload.channel_id in self.channels:
+            await self.collection.update_one({"_id": payload.message_id}, {"$set": {"deleted": True}})
+
+    async def catch_up(self, bot: commands.Bot) -> None:
+        """Captures the messages sent in tracked tickets since the last stored one."""
+
+        for channel_id in list(self.channels):
+            channel = bot.get_channel(channel_id)
+            if channel is None:
+                continue
+
+            last = await self.collection.find_one({"channel_id": channel_id}, {"_id": 1}, sort=[("_id", DESCENDING)])
+            after = discord.Object(last["_id"]) if last else None
+
+            try:
+                async for message in channel.history(limit=None, after=after, oldest_first=True):
+                    await self.record(message)
+            except (discord.HTTPException, PyMongoError) as e:
+                _log.warning("Could not catch up on ticket %s: %s", channel_id, e)
+
+    async def messages(self, channel_id: int) -> list[TicketMessage]:
+        cursor = self.collection.find({"channel_id": channel_id}).sort("_id", ASCENDING)
+        return await cursor.to_list(None)
+
+
+def message_text(messages: list[TicketMessage]) -> str:
+    """Flattens stored messages into searchable text, like :func:`transcript_index.transcript_text`."""
+
+    lines = []
+    for message in messages:
+        parts = [message["content"]]
+
+        for embed in message["embeds"]:
+            parts.extend(x for x in (embed.get("title"), embed.get("description")) if x)
+            parts.extend(f"{field['name']} {field['value']}" for field in embed.get("fields", []))
+
+        parts.extend(attachment["filename"] for attachment in message["attachments"])
+        lines.append(f"{message['author']}: {' '.join(x for x in parts if x)}")
+
+    return "\n".join(lines)
+
+
+page_style = """
+body { background: #313338; color: #dbdee1; font-family: "gg sans", "Helvetica Neue", Arial, sans-serif; margin: 0; padding: 16px; }
+h1 { font-size: 20px; margin: 0 0 16px; }
+.message { display: flex; gap: 12px; padding: 6px 0; }
+.message img.avatar { width: 40px; height: 40px; border-radius: 50%; }
+.author { font-weight: 600; color: #f2f3f5; }
+.time, .edited { color: #949ba4; font-size: 12px; margin-left: 6px; }
+.deleted { opacity: 0.5; text-decoration: line-through; }
+.content { white-space: pre-wrap; word-wrap: break-word; }
+.embed { border-left: 4px solid #599ae0; background: #2b2d31; border-radius: 4px; padding: 8px 12px; margin-top: 4px; max-width: 520px; }
+.embed .title { font-weight: 600; }
+.attachment img { max-width: 400px; max-height: 300px; border-radius: 4px; margin-top: 4px; }
+"""
+
+
+def _embed_html(embed: dict) -> str:
+    parts = []
+
+    if embed.get("author", {}).get("name"):
+        parts.append(f'<div class="title">{html.escape(embed["author"]["name"])}</div>')
+    if embed.get("title"):
+        parts.append(f'<div class="title">{html.escape(embed["title"])}</div>')
+    if embed.get("description"):
+        parts.append(f'<div class="content">{html.escape(embed["description"])}</div>')
+
+    for field in embed.get("fields", []):
+        parts.append(f'<div><b>{html.escape(field["name"])}</b><div class="content">{html.escape(field["value"])}</div></div>')
+
+    if embed.get("footer", {}).get("text"):
+        parts.append(f'<div class="time">{html.escape(embed["footer"]["text"])}</div>')
+
+    return f'<div class="embed">{"".join(parts)}</div>'
+
+
+def render_messages(title: str, messages: list[TicketMessage]) -> str:
+    """Renders stored messages into a self-contained HTML transcript."""
+
+    rows = []
+    for message in messages:
+        body = [
+            f'<span class="author">{html.escape(message["author"])}</span>'
+            f'<span class="time">{message["created_at"]:%Y-%m-%d %H:%M} UTC</span>'
+        ]
+
+        if message.get("edited_at"):
+            body.append('<span class="edited">(edited)</span>')
+        if message.get("deleted"):
+            body.append('<span class="edited">(deleted)</span>')
+
+        if message["content"]:
+            body.append(f'<div class="content">{html.escape(message["content"])}</div>')
+
+        body.extend(_embed_html(embed) for embed in message["embeds"])
+
+        for attachment in message["attachments"]:
+            url = html.escape(attachment["url"])
+            name = html.escape(attachment["filename"])
+
+            if (attachment.get("content_type") or "").startswith("image/"):
+                body.append(f'<div class="attachment"><a href="{url}"><img src="{url}" alt="{name}"></a></div>')
+            else:
+                body.append(f'<div class="attachment"><a href="{url}">{name}</a></div>')
+
+        css_class = "message deleted" if message.get("deleted") else "message"
+        avatar = html.escape(message["avatar_url"])
+        rows.append(f'<div class="{css_class}"><img class="avatar" src="{avatar}" alt=""><div>{"".join(body)}</div></div>')
+
+    return (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+        f'<style>{page_style}</style></head><body><h1>{html.escape(title)}</h1>{"".join(rows)}</body></html>'
+    )
@@ -0,0 +1,196 @@
+import asyncio
+from collections import defaultdict
+
+import discord
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from _types import Ticket, TicketChannels
+
+
+class TicketChannelResolver:
+    """Maps each ticket category to its category channel and transcripts channel.
+
+    Channel IDs are persisted in the ``ticket_channels`` collection and cached
+    in memory, so a lookup is a dict access and a guild cache hit. Channels that
+    are missing are looked up by name, or created, under a per-category lock so
+    racing interactions never create them twice. Channel create and delete
+    events keep the cache current through :meth:`channel_created` and
+    :meth:`channel_deleted`.
+    """
+
+    transcripts_name = "transcripts"
+
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self.collection = collection
+        self.entries: dict[tuple[int, str], TicketChannels] = {}
+        self._locks: dict[tuple[int, str], asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    @staticmethod
+    def category_name(category: str) -> str:
+        return f"{category} Tickets"
+
+    @staticmethod
+    def ticket_category(channel: discord.CategoryChannel | None) -> str | None:
+        if channel is None or not channel.name.endswith(" Tickets"):
+            return None
+
+        return channel.name.removesuffix(" Tickets")
+
+    async def load(self) -> None:
+        """Loads the persisted channel IDs."""
+
+        async for entry in self.collection.find():
+            self.entries[(entry["guild_id"], entry["category"])] = entry
+
+    async def warm(self, guild: discord.Guild) -> None:
+        """Records the ticket categories and transcripts channels that already exist in ``guild``."""
+
+        for category_channel in guild.categories:
+            category = self.ticket_category(category_channel)
+            if category is None:
+                continue
+
+            cached_category, cached_transcripts = self.cached(guild, category)
+            if cached_category is not None and cached_transcripts is not None:
+                continue
+
+            category_channel = cached_category or category_channel
+            transcripts = cached_transcripts or discord.utils.get(category_channel.text_channels, name=self.transcripts_name)
+            await self._store(guild, category, category_channel, transcripts)
+
+    def cached(self, guild: discord.Guild, category: str) -> tuple[discord.CategoryChannel | None, discord.TextChannel | None]:
+        entry = self.entries.get((guild.id, category), {})
+
+        category_channel = guild.get_channel(entry.get("category_id", 0))
+        transcripts = guild.get_channel(entry.get("transcripts_id", 0))
+
+        return category_channel, transcripts
+
+    async def resolve(
+        self,
+        guild: discord.Guild,
+        category: str,
+        overwrites: dict[discord.Role | discord.Member, discord.PermissionOverwrite],
+    ) -> tuple[discord.CategoryChannel, discord.TextChannel]:
+        """Returns the category and transcripts channels for ``category``, creating whichever is missing."""
+
+        category_channel, transcripts = self.cached(guild, category)
+        if category_channel is not None and transcripts is not None:
+            return category_channel, transcripts
+
+        async with self._locks[(guild.id, category)]:
+            category_channel, transcripts = self.cached(guild, category)
+            if category_channel is not None and transcripts is not None:
+                return category_channel, transcripts
+
+            if category_channel is None:
+                name = self.category_name(category)
+                category_channel = discord.utils.get(guild.categories, name=name) or await guild.create_category(name)
+
+            if transcripts is None:
+                transcripts = (
+                    discord.utils.get(category_channel.text_channels, name=self.transcripts_name)
+                    or await category_channel.create_text_channel(self.transcripts_name, overwrites=overwrites)
+                )
+
+            await self._store(guild, category, category_channel, transcripts)
+
+        return category_channel, transcripts
+
+    async def channel_created(self, channel: discord.abc.GuildChannel) -> None:
+        """Fills in a category's missing channel when a matching one is created."""
+
+        if isinstance(channel, discord.CategoryChannel):
+            category = self.ticket_category(channel)
+            category_channel, transcripts = channel, None
+        elif isinstance(channel, discord.TextChannel) and channel.name == self.transcripts_name:
+            category = self.ticket_category(channel.category)
+            category_channel, transcripts = channel.category, channel
+        else:
+            return
+
+        if category is None:
+            return
+
+        cached_category, cached_transcripts = self.cached(channel.guild, category)
+        if cached_category is not None and cached_category != category_channel:
+            return
+
+        if cached_transcripts is None and transcripts is not None:
+            await self._store(channel.guild, category, category_channel, transcripts)
+        elif cached_category is None:
+            await self._store(channel.guild, category, category_channel, cached_transcripts)
+
+    async def channel_deleted(self, channel: discord.abc.GuildChannel) -> None:
+        """Forgets a deleted category or transcripts channel."""
+
+        for (guild_id, category), entry in list(self.entries.items()):
+            if guild_id != channel.guild.id:
+                continue
+
+            for field in ("category_id", "transcripts_id"):
+                if entry.get(field) == channel.id:
+                    del entry[field]
+                    await self.collection.update_one({"_id": entry["_id"]}, {"$unset": {field: ""}})
+
+    async def _store(
+        self,
+        guild: discord.Guild,
+        category: str,
+        category_channel: discord.CategoryChannel,
+        transcripts: discord.TextChannel | None,
+    ) -> None:
+        entry: TicketChannels = {
+            "_id": f"{guild.id}:{category}",
+            "guild_id": guild.id,
+            "category": category,
+            "category_id": category_channel.id,
+        }
+
+        if transcripts is not None:
+            entry["transcripts_id"] = transcripts.id
+
+        self.entries[(guild.id, category)] = entry
+
+        fields = {key: value for key, value in entry.items() if key != "_id"}
+        await self.collection.replace_one({"_id": entry["_id"]}, fields, upsert=True)
+
+
+class OpenTicketCache:
+    """In-memory copy of every open ticket, keyed by channel ID.
+
+    Loaded once at startup and kept current write-through by the code that
+    opens and closes tickets, so ticket commands can check a channel and read
+    its creator without a database round trip.
+    """
+
+    def __init__(self):
+        self.tickets: dict[int, Ticket] = {}
+        self._by_user: dict[tuple[int, str], int] = {}
+
+    async def load(self, collection: AsyncIOMotorCollection) -> None:
+        async for ticket in collection.find({"open": True}):
+            self.put(ticket)
+
+    def get(self, channel_id: int) -> Ticket | None:
+        return self.tickets.get(channel_id)
+
+    def find(self, user_id: int, category: str) -> Ticket | None:
+        """Returns the user's open ticket in ``category``, if any."""
+
+        channel_id = self._by_user.get((user_id, category))
+        return self.tickets.get(channel_id) if channel_id is not None else None
+
+    def put(self, ticket: Ticket) -> None:
+        self.tickets[ticket["channel_id"]] = ticket
+        self._by_user[(ticket["user_id"], ticket["category"])] = ticket["channel_id"]
+
+    def discard(self, channel_id: int) -> Ticket | None:
+        ticket = self.tickets.pop(channel_id, None)
+
+        if ticket is not None:
+            key = (ticket["user_id"], ticket["category"])
+            if self._by_user.get(key) == channel_id:
+                del self._by_user[key]
+
+        return ticket
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+import discord
+
+schema = """
+CREATE VIRTUAL TABLE IF NOT EXISTS transcripts USING fts5(
+    content,
+    name,
+    creator,
+    closer,
+    category,
+    creator_id UNINDEXED,
+    closer_id UNINDEXED,
+    created_at UNINDEXED,
+    closed_at UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+
+@dataclass
+class SearchHit:
+    channel_id: int
+    name: str
+    category: str
+    creator: str
+    closer: str
+    closed_at: str
+    snippet: str
+    score: float
+
+
+def transcript_text(messages: list[discord.Message]) -> str:
+    """Flattens a ticket's messages, including embeds and attachment names, into searchable text."""
+
+    lines = []
+    for message in messages:
+        parts = [message.clean_content]
+
+        for embed in message.embeds:
+            parts.extend(x for x in (embed.title, embed.description) if x)
+            parts.extend(f"{field.name} {field.value}" for field in embed.fields)
+
+        parts.extend(attachment.filename for attachment in message.attachments)
+        lines.append(f"{message.author}: {' '.join(x for x in parts if x)}")
+
+    return "\n".join(lines)
+
+
+class TranscriptIndex:
+    """Full-text index of closed tickets, kept in SQLite FTS5 on the volume.
+
+    Each ticket is one row keyed by its channel ID, holding the transcript text
+    and the ticket's name, creator, closer and category, so searches rank over
+    all of them with BM25. SQLite calls block, so the async methods run them in
+    a worker thread over one shared WAL-mode connection.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(os.getenv("RAILWAY_VOLUME_MOUNT_PATH", "."), "transcripts.db")
+        self._connection: sqlite3.Connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(schema)
+            self._connection = connection
+
+        return self._connection
+
+    async def add(self, channel_id: int, content: str, metadata: dict) -> None:
+        """Indexes a ticket, replacing it if it was indexed before."""
+
+        await asyncio.to_thread(self._add, channel_id, content, metadata)
+
+    def _add(self, channel_id: int, content: str, metadata: dict) -> None:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM transcripts WHERE rowid = ?", (channel_id,))
+                connection.execute(
+                    "INSERT INTO transcripts (rowid, content, name, creator, closer, category, creator_id, closer_id, created_at, closed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        channel_id,
+                        content,
+                        metadata.get("name", ""),
+                        metadata.get("creator", ""),
+                        metadata.get("closer", ""),
+                        metadata.get("category", ""),
+                        metadata.get("creator_id"),
+                        metadata.get("closer_id"),
+                        str(metadata.get("created_at") or ""),
+                        str(metadata.get("closed_at") or ""),
+                    ),
+                )
+
+    async def search(self, query: str, category: str = None, limit: int = 10) -> list[SearchHit]:
+        """Returns the best matches for every word of ``query``, optionally within one category."""
+
+        return await asyncio.to_thread(self._search, query, category, limit)
+
+    def _search(self, query: str, category: str = None, limit: int = 10) -> list[SearchHit]:
+        # Quote every word so user input is never parsed as FTS5 syntax.
+        terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+        if not terms:
+            return []
+
+        sql = (
+            "SELECT rowid, name, category, creator, closer, closed_at, "
+            "snippet(transcripts, 0, '**', '**', '...', 16), bm25(transcripts, 1.0, 2.0, 4.0, 2.0, 1.0) AS score "
+            "FROM transcripts WHERE transcripts MATCH ?"
+        )
+        params = [" ".join(terms)]
+
+        if category:
+            sql += " AND category = ?"
+            params.append(category)
+
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+
+        return [SearchHit(*row) for row in rows]
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import discord
+from discord.ext import commands
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+
+from _types import TranscriptJob, TranscriptMetadata
+from ticket_log import TicketMessageStore, message_text
+from transcript_index import TranscriptIndex, transcript_text
+from utils import save_transcript
+
+_log = logging.getLogger(__name__)
+
+
+def transcript_url(channel_id: int) -> str:
+    return f"https://bry.up.railway.app/view?channel_id={channel_id}"
+
+
+class TranscriptQueue:
+    """Persisted queue of ticket transcript exports.
+
+    Closing a ticket only inserts a job into the ``transcript_jobs`` collection.
+    A pool of ``workers`` tasks claims jobs with an atomic status update, so any
+    number of bot processes can share the queue. Each job exports the channel,
+    writes the file off the event loop, adds it to the search ``index``, posts
+    the transcript message and then deletes the ticket channel. Tickets whose
+    messages were captured into the ``store`` skip the export entirely; their
+    transcript is rendered from the store when it is first viewed. Failed jobs
+    are retried with exponential backoff up to ``max_attempts`` times, and a job
+    whose worker died is reclaimed once its ``lease`` runs out.
+    """
+
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        bot: commands.Bot,
+        index: TranscriptIndex,
+        store: TicketMessageStore,
+        workers: int = 2,
+        max_attempts: int = 5,
+        lease: float = 600,
+        poll_interval: float = 30,
+    ):
+        self.collection = collection
+        self.bot = bot
+        self.index = index
+        self.store = store
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+        self._tasks = []
+
+    async def enqueue(
+        self,
+        channel_id: int,
+        transcripts_id: int,
+        embed: discord.Embed,
+        metadata: TranscriptMetadata,
+        captured: bool = False,
+    ) -> None:
+        """Queues the transcript of ``channel_id`` to be posted in ``transcripts_id``."""
+
+        now = datetime.utcnow()
+        job: TranscriptJob = {
+            "channel_id": channel_id,
+            "transcripts_id": transcripts_id,
+            "embed": embed.to_dict(),
+            "metadata": metadata,
+            "captured": captured,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "available_at": now,
+        }
+
+        await self.collection.insert_one(job)
+        self._wakeup.set()
+
+    async def _claim(self) -> TranscriptJob | None:
+        now = datetime.utcnow()
+
+        return await self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending", "available_at": {"$lte": now}},
+                    {"status": "running", "claimed_at": {"$lte": now - timedelta(seconds=self.lease)}},
+                ]
+            },
+            {"$set": {"status": "running", "claimed_at": now}, "$inc": {"attempts": 1}},
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _run(self) -> None:
+        await self.bot.wait_until_ready()
+
+        while True:
+            try:
+                handled = await self._step()
+            except Exception as e:
+                # A job whose acknowledgement was lost is reclaimed once its lease runs out.
+                _log.warning("Transcript worker error: %s", e)
+                await asyncio.sleep(5)
+                continue
+
+            if not handled:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _step(self) -> bool:
+        """Claims, processes and acknowledges one job. Returns whether there was one."""
+
+        job = await self._claim()
+        if job is None:
+            return False
+
+        try:
+            await self._process(job)
+        except Exception as e:
+            await self._failed(job, e)
+        else:
+            await self.collection.update_one({"_id": job["_id"]}, {"$set": {"status": "done"}})
+
+        return True
+
+    async def _process(self, job: TranscriptJob) -> None:
+        channel = self.bot.get_channel(job["channel_id"])
+        if channel is None and job.get("posted"):
+            return
+        elif channel is None:
+            raise Exception(f"Ticket channel {job['channel_id']} no longer exists.")
+
+        if not job.get("posted"):
+            transcripts = self.bot.get_channel(job["transcripts_id"])
+            if transcripts is None:
+                raise Exception(f"Transcripts channel {job['transcripts_id']} no longer exists.")
+
+            if job.get("captured"):
+                file = None
+                stored = await self.store.messages(channel.id)
+                await self.index.add(channel.id, message_text(stored), job.get("metadata", {}))
+            else:
+                messages = [message async for message in channel.history(limit=None, oldest_first=True)]
+                file = await save_transcript(channel, messages)
+                await self.index.add(channel.id, transcript_text(messages), job.get("metadata", {}))
+
+            view = discord.ui.View()
+            view_transcript = discord.ui.Button(emoji="\N{PAGE FACING UP}", label="View Transcript", url=transcript_url(channel.id), style=discord.ButtonStyle.link)
+            view.add_item(view_transcript)
+
+            await transcripts.send(embed=discord.Embed.from_dict(job["embed"]), view=view, file=file)
+            await self.collection.update_one({"_id": job["_id"]}, {"$set": {"posted": True}})
+
+        try:
+            await channel.delete()
+        except discord.NotFound:
+            pass
+
+    async def _failed(self, job: TranscriptJob, error: Exception) -> None:
+        attempts = job["attempts"]
+
+        if attempts >= self.max_attempts:
+            _log.error("Giving up on the transcript of channel %s after %d attempts: %s", job["channel_id"], attempts, error)
+            update = {"status": "failed", "error": str(error)}
+        else:
+            _log.warning("Transcript of channel %s failed (attempt %d): %s", job["channel_id"], attempts, error)
+            available_at = datetime.utcnow() + timedelta(seconds=2 ** attempts)
+            update = {"status": "pending", "error": str(error), "available_at": available_at}
+
+        await self.collection.update_one({"_id": job["_id"]}, {"$set": update})
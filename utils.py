@@ -1,23 +1,59 @@
+import asyncio
+import gzip
+import hashlib
 import io
 import json
 import locale
 import logging
 import os
 import re
+import tempfile
+import time
+from collections import deque
 from datetime import datetime, timedelta
 import chat_exporter
 
 import discord
-import gspread
 import requests
-from oauth2client.service_account import ServiceAccountCredentials
 
 from constants import *
 
 locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
 
-async def save_transcript(channel: discord.TextChannel):
-    transcript = await chat_exporter.export(channel)
+_log = logging.getLogger(__name__)
+
+def transcript_path(channel_id: int | str, compressed: bool = True) -> str:
+    """Path of a transcript on the volume. Older transcripts are stored uncompressed."""
+
+    extension = "html.gz" if compressed else "html"
+    return f"{os.getenv('RAILWAY_VOLUME_MOUNT_PATH')}/transcript-{channel_id}.{extension}"
+
+
+def write_compressed(path: str, data: bytes) -> None:
+    # zlib releases the GIL while compressing, so this runs in parallel with the loop.
+    # The file is swapped in whole so readers never see a partial transcript, and the
+    # temporary name is unique so concurrent writers from other processes never share it.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(gzip.compress(data, compresslevel=6))
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_decompressed(path: str) -> bytes:
+    with gzip.open(path, "rb") as file:
+        return file.read()
+
+
+async def save_transcript(channel: discord.TextChannel, messages: list[discord.Message] = None):
+    if messages is None:
+        transcript = await chat_exporter.export(channel)
+    else:
+        transcript = await chat_exporter.raw_export(channel, messages)
 
     if not transcript:
         return
@@ -25,8 +61,7 @@ async def save_transcript(channel: discord.TextChannel):
     data = transcript.encode()
     filename = f"transcript-{channel.id}.html"
     
-    with open(f"{os.getenv('RAILWAY_VOLUME_MOUNT_PATH')}/{filename}", "wb") as file:
-        file.write(data)
+    await asyncio.to_thread(write_compressed, transcript_path(channel.id), data)
         
     return discord.File(io.BytesIO(data), filename=filename)
 
@@ -38,6 +73,47 @@ def calc_discount(total, item_count):
         return 0
 
 
+# Rollup keys for the revenue collection. These are valid for both strftime
+# and MongoDB's $dateToString so backfills produce the same keys as live writes.
+revenue_formats = ["day:%Y-%m-%d", "week:%G-W%V", "month:%Y-%m"]
+
+
+def revenue_periods(when: datetime) -> list[str]:
+    return [when.strftime(period_format) for period_format in revenue_formats]
+
+
+# Minimum total spent for each tier role, highest first.
+tiers = [(1500, 5), (1000, 4), (500, 3), (250, 2), (100, 1)]
+
+
+def customer_rollup(when_matched: str) -> list[dict]:
+    """Aggregation pipeline that merges per-user totals from the logs into ``customers``."""
+
+    tier_branches = [{"case": {"$gte": ["$total_spent", threshold]}, "then": tier} for threshold, tier in tiers]
+    return [
+        {
+            "$group": {
+                "_id": "$user_id",
+                "total_spent": {"$sum": "$item.price"},
+                "transaction_count": {"$sum": 1},
+                "last_purchase_at": {"$max": "$created_at"},
+            }
+        },
+        {"$set": {"tier": {"$switch": {"branches": tier_branches, "default": 0}}}},
+        {"$merge": {"into": "customers", "whenMatched": when_matched}},
+    ]
+
+
+def embed_digest(embed: discord.Embed) -> str:
+    """Hashes the canonical form of an embed, ignoring its timestamp."""
+
+    data = embed.to_dict()
+    data.pop("timestamp", None)
+
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
 def split_list(lst, chunk_size):
     return [lst[i:i+chunk_size] for i in range(0, len(lst), chunk_size)]
 
@@ -65,80 +141,6 @@ def fetch_roblox_id(username: str) -> int | None:
         return None
 
 
-header_styles = {
-    "backgroundColor": {
-        "red": 0.92,
-        "green": 0.82,
-        "blue": 0.86,
-    },
-    "horizontalAlignment": "CENTER",
-    "textFormat": {
-        "fontSize": 12,
-        "bold": True,
-    }
-}
-
-row_styles = {
-    "backgroundColor": {
-        "red": 1,
-        "green": 1,
-        "blue": 1,
-    },
-    "horizontalAlignment": "CENTER",
-    "textFormat": {
-        "fontSize": 10,
-    }
-}
-
-
-def write_to_ws(new_total: int, username: str, user_id: int, item: str, price: int) -> None:
-    if not IS_PROD:
-        return
-
-    scope = ['https://spreadsheets.google.com/feeds',
-             'https://www.googleapis.com/auth/drive']
-
-    credentials = ServiceAccountCredentials.from_json_keyfile_name(
-        'credentials.json', scope)
-
-    gc = gspread.authorize(credentials)
-    ss = gc.open_by_key(os.getenv('SPREADSHEET_ID'))
-    ws = ss.get_worksheet(0)
-
-    current_time = datetime.now()
-    date = current_time.strftime('%m/%d/%y')
-
-    display_price = locale.currency(price, grouping=True)
-    roblox_id = fetch_roblox_id(username) or ""
-
-    data = [date, username, roblox_id, str(user_id), item, display_price]
-
-    existing_data = ws.get_all_values()
-    row = len(existing_data) + 1
-
-    if len(existing_data) == 0 or data[0] != existing_data[-1][0]:
-        header_row = [
-            "Date", "User", "Customer (Roblox ID)", "Discord ID", "Item", "Amount", "Total Cost"]
-
-        ws.append_row(header_row)
-        ws.format(f"A{row}:G{row}", header_styles)
-        row += 1
-
-    ws.append_row(data)
-
-    ws.format([f"A{row}", f"C{row}:D{row}"], {
-              **row_styles, "textFormat": {"bold": False}})
-    ws.format([f"B{row}", f"E{row}:G{row}"], {
-              **row_styles, "textFormat": {"bold": True}})
-
-    header_row = 0
-    for i, row in enumerate(existing_data, start=2):
-        if row[0] == "Date":
-            header_row = i
-
-    ws.update_cell(header_row, 7, locale.currency(new_total, grouping=True))
-
-
 def parse_human_duration(duration: str) -> timedelta:
     components = {
         "weeks": 0,
@@ -186,6 +188,88 @@ class ActionCache:
     mute: MemberLog
 
 
+class ChannelNamePublisher:
+    """Renames counter channels within Discord's channel rename limit.
+
+    Discord allows about ``limit`` renames per channel every ``per`` seconds
+    and parks anything past that in a long rate-limit sleep. Renames that would
+    not change the name are skipped, and renames over budget are deferred
+    until it frees up, at which point only the latest name is published.
+    """
+
+    def __init__(self, limit: int = 2, per: float = 600.0):
+        self.limit = limit
+        self.per = per
+        self.names: dict[int, str] = {}
+        self.pending: dict[int, str] = {}
+        self.renames: dict[int, deque[float]] = {}
+        self.published = 0
+        self.skipped = 0
+        self.deferred = 0
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def publish(self, channel: discord.abc.GuildChannel, name: str) -> None:
+        """Schedules ``channel`` to be renamed to ``name`` as soon as its budget allows."""
+
+        current = self.names.setdefault(channel.id, channel.name)
+
+        if name == current:
+            self.pending.pop(channel.id, None)
+            self.skipped += 1
+            return
+
+        self.pending[channel.id] = name
+
+        if channel.id in self._tasks or self._delay(channel.id) > 0:
+            self.deferred += 1
+
+        if channel.id not in self._tasks:
+            self._tasks[channel.id] = asyncio.create_task(self._drain(channel))
+
+    def stop(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+
+        self._tasks.clear()
+
+    def _delay(self, channel_id: int) -> float:
+        renames = self.renames.setdefault(channel_id, deque())
+        now = time.monotonic()
+
+        while renames and renames[0] <= now - self.per:
+            renames.popleft()
+
+        if len(renames) < self.limit:
+            return 0
+
+        return renames[0] + self.per - now
+
+    async def _drain(self, channel: discord.abc.GuildChannel) -> None:
+        try:
+            while channel.id in self.pending:
+                delay = self._delay(channel.id)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+
+                name = self.pending.pop(channel.id)
+                if name == self.names[channel.id]:
+                    self.skipped += 1
+                    continue
+
+                self.renames[channel.id].append(time.monotonic())
+
+                try:
+                    await channel.edit(name=name)
+                except discord.HTTPException as e:
+                    _log.warning("Could not rename channel %s to %r: %s", channel.id, name, e)
+                else:
+                    self.names[channel.id] = name
+                    self.published += 1
+        finally:
+            self._tasks.pop(channel.id, None)
+
+
 class LogFormatter(logging.Formatter):
     LEVEL_COLOURS = [
         (logging.DEBUG, "\x1b[40;1m"),
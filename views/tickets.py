@@ -1,17 +1,18 @@
-import asyncio
 import re
-from collections import defaultdict
+from collections import Counter
 import chat_exporter
 
 import discord
 import humanize
 import requests
-from pymongo.collection import Collection
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
 
-from _types import Stock, Ticket
+from _types import Ticket, TicketCounter
+from catalog import Cart, StockCatalog
 from bot import Bot
 from constants import *
-from utils import calc_discount, save_transcript, split_list
 
 
 class DynamicDelete(
@@ -42,6 +43,8 @@ class DynamicDelete(
             await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
             return
 
+        await interaction.response.defer()
+
         embed = discord.Embed(color=0x599ae0)
 
         embed.set_author(
@@ -56,23 +59,32 @@ class DynamicDelete(
 
         await interaction.channel.send(embed=embed)
 
-        category = interaction.channel.category
-        channel = next((channel for channel in category.text_channels if channel.name == "transcripts"), None)
-
         overwrites = {interaction.guild.default_role: discord.PermissionOverwrite(view_channel=False)}
-        if not channel:
-            channel = await category.create_text_channel('transcripts', overwrites=overwrites)
+        _, channel = await interaction.client.ticket_channels.resolve(interaction.guild, self.category, overwrites)
 
-        ticket_collection: Collection[Ticket] = interaction.client.database.get_collection("tickets")
-        
-        filter = {"channel_id": interaction.channel_id}
-        update = {"$set": {"open": False}}
-        ticket = ticket_collection.find_one_and_update(filter, update)
+        # Taking the ticket out of the cache first makes a second click see it as closed.
+        ticket = interaction.client.open_tickets.discard(interaction.channel_id)
 
         if ticket == None:
             await interaction.followup.send("This ticket has already been closed.", ephemeral=True)
             return
 
+        ticket_collection: AsyncIOMotorCollection = interaction.client.database.get_collection("tickets")
+        
+        filter = {"channel_id": interaction.channel_id}
+        update = {"$set": {"open": False}, "$unset": {"data.reserved": ""}}
+
+        try:
+            await ticket_collection.update_one(filter, update)
+        except BaseException:
+            # Still open in the database, so let the close be retried.
+            interaction.client.open_tickets.put(ticket)
+            raise
+
+        reserved = ticket.get("data", {}).get("reserved")
+        if reserved:
+            await interaction.client.catalog.release({ObjectId(id): quantity for id, quantity in reserved.items()})
+
         creator_name = ticket["username"]
         creator_id = ticket["user_id"]
 
@@ -96,19 +108,25 @@ class DynamicDelete(
             icon_url=interaction.guild.icon
         )
 
-        view = discord.ui.View()
-
-        params = f"channel_id={interaction.channel_id}"
-        transcript_url = f"https://bry.up.railway.app/view?{params}"
-
-        view_transcript = discord.ui.Button(emoji="\N{PAGE FACING UP}", label="View Transcript", url=transcript_url, style=discord.ButtonStyle.link)
-        view.add_item(view_transcript)
-        
-        file = await save_transcript(interaction.channel)
+        metadata = {
+            "name": interaction.channel.name,
+            "category": self.category,
+            "creator": creator_name,
+            "creator_id": creator_id,
+            "closer": str(interaction.user),
+            "closer_id": interaction.user.id,
+            "created_at": created_at,
+            "closed_at": current_time,
+        }
 
-        await channel.send(embed=embed, view=view, file=file)
-        await asyncio.sleep(2)
-        await interaction.channel.delete()
+        # The transcript is exported, posted and the channel deleted in the background.
+        await interaction.client.transcripts.enqueue(
+            interaction.channel_id,
+            channel.id,
+            embed,
+            metadata,
+            captured=ticket.get("captured", False),
+        )
 
 
 class DynamicToggle(
@@ -167,10 +185,7 @@ class DynamicToggle(
 
         message = await interaction.channel.send(embed=embed)
 
-        ticket_collection: Collection[Ticket] = interaction.client.database.get_collection("tickets")
-
-        filter = {"channel_id": interaction.channel_id}
-        ticket = ticket_collection.find_one(filter)
+        ticket = interaction.client.open_tickets.get(interaction.channel_id)
 
         if ticket == None:
             await interaction.followup.send("This ticket has already been closed.", ephemeral=True)
@@ -256,24 +271,31 @@ class CreationModal(discord.ui.Modal):
         await interaction.response.defer(ephemeral=True)
         await create_ticket(interaction, self.category, self.input.value)
 
-async def create_ticket(interaction: discord.Interaction[Bot], category: str, reason: str, data: dict = None):
-    category_name = f"{category} Tickets"
-    category_channel = next((category for category in interaction.guild.categories if category.name == category_name), None)
+async def create_ticket(
+    interaction: discord.Interaction[Bot],
+    category: str,
+    reason: str,
+    data: dict = None,
+    reserve: Counter[ObjectId] = None,
+) -> discord.TextChannel | None:
+    """Opens a ticket channel for the user.
+
+    ``reserve`` is taken out of stock once the payment method is chosen and is
+    recorded on the ticket as ``data.reserved``. It is only given back here if
+    the ticket was never saved; once it is, closing the ticket releases it.
+    """
 
     overwrites = {
         interaction.guild.default_role: discord.PermissionOverwrite(view_channel=False),
         interaction.client.config.roles.staff: discord.PermissionOverwrite(view_channel=True),
     }
 
-    if not category_channel:
-        category_channel = await interaction.guild.create_category(category_name)
-        await category_channel.create_text_channel('transcripts', overwrites=overwrites)
-        
-    ticket_collection: Collection[Ticket] = interaction.client.database.get_collection("tickets")
-    ticket_count = ticket_collection.count_documents({})
+    category_channel, _ = await interaction.client.ticket_channels.resolve(interaction.guild, category, overwrites)
+
+    ticket_collection: AsyncIOMotorCollection = interaction.client.database.get_collection("tickets")
 
     filter = {"user_id": interaction.user.id, "category": category, "open": True}
-    open_ticket = ticket_collection.find_one(filter)
+    open_ticket = interaction.client.open_tickets.find(interaction.user.id, category)
 
     if open_ticket:
         await interaction.followup.send(f"You already have an open ticket at <#{open_ticket['channel_id']}>.", ephemeral=True)
@@ -288,36 +310,70 @@ async def create_ticket(interaction: discord.Interaction[Bot], category: str, re
         if payment_method == None:
             return
 
-    ticket_id = str(ticket_count).rjust(4, "0")
-    
-    name = f'ticket-{interaction.user.name[:5]}-{ticket_id}'
-    user_overwrites = {**overwrites, interaction.user: discord.PermissionOverwrite(view_channel=True)}
-    channel = await category_channel.create_text_channel(name, overwrites=user_overwrites)
+    reserved = False
+
+    try:
+        if reserve:
+            # reserve() gives back whatever it claimed when it fails, so only a
+            # completed reservation is released below.
+            catalog = interaction.client.catalog
+            unavailable = await catalog.reserve(reserve)
+
+            if unavailable:
+                names = [f"{item.get('set', '')} {item['name']}".strip() for item in map(catalog.get, unavailable) if item]
+                await interaction.followup.send(f"Sorry, there isn't enough stock left for: {', '.join(names)}.", ephemeral=True)
+                return
+
+            reserved = True
+            data = {**data, "reserved": {str(id): quantity for id, quantity in reserve.items()}}
+
+        # Numbers are handed out by an atomic $inc, so concurrent tickets never share one.
+        counter_collection: AsyncIOMotorCollection = interaction.client.database.get_collection("counters")
+        counter: TicketCounter = await counter_collection.find_one_and_update(
+            {"_id": "tickets"},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
 
-    embed = discord.Embed(
-        color=0x599ae0,
-        description=f"Your ticket has been created at {channel.mention}."
-    )
+        ticket_id = str(counter["seq"] - 1).rjust(4, "0")
+    
+        name = f'ticket-{interaction.user.name[:5]}-{ticket_id}'
+        user_overwrites = {**overwrites, interaction.user: discord.PermissionOverwrite(view_channel=True)}
+        channel = await category_channel.create_text_channel(name, overwrites=user_overwrites)
+        interaction.client.ticket_messages.track(channel.id)
 
-    await interaction.followup.send(embed=embed, ephemeral=True)
+        embed = discord.Embed(
+            color=0x599ae0,
+            description=f"Your ticket has been created at {channel.mention}."
+        )
 
-    update = {
-        "$set": {
-            "user_id": interaction.user.id,
-            "channel_id": channel.id,
-            "username": interaction.user.name,
-            "category": category,
-            "open": True,
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+        update = {
+            "$set": {
+                "user_id": interaction.user.id,
+                "channel_id": channel.id,
+                "username": interaction.user.name,
+                "category": category,
+                "open": True,
+                "captured": True,
+            }
         }
-    }
 
-    if category == "Purchase":
-        update["$set"]["data"] = {
-            "payment_method": payment_method,
-            **data,
-        }
+        if category == "Purchase":
+            update["$set"]["data"] = {
+                "payment_method": payment_method,
+                **data,
+            }
 
-    ticket_collection.update_one(filter, update, upsert=True)
+        ticket: Ticket = await ticket_collection.find_one_and_update(filter, update, upsert=True, return_document=ReturnDocument.AFTER)
+    except BaseException:
+        if reserved:
+            await interaction.client.catalog.release(reserve)
+        raise
+
+    interaction.client.open_tickets.put(ticket)
 
     embed = discord.Embed(
         color=0x599ae0,
@@ -338,7 +394,7 @@ Feel free to provide more info in the meantime.
     )
 
     embed.set_author(
-        name=f"Ticket #{ticket_count} ({category})",
+        name=f"Ticket #{ticket_id} ({category})",
         icon_url=ICONS.ticket
     )
 
@@ -356,69 +412,19 @@ Feel free to provide more info in the meantime.
     message = await channel.send(f"{interaction.user.mention} {mention}", embed=embed, view=view)
     await message.pin()
 
+    return channel
+
 class PurchaseDropdown(discord.ui.View):
-    def __init__(self, bot: Bot):
+    def __init__(self, catalog: StockCatalog):
         super().__init__(timeout=None)
-        self.values = []
-        self.sets = defaultdict(lambda: {"price": 0, "total_quantity": 0, "items": []})
-        self.reason = ""
-        self.subtotal = 0
-        self.total = 0
-
-        stock_collection = bot.database.get_collection("stock")
-
-        for stock_item in stock_collection.find().sort("set"):
-            set_name = stock_item.get("set", "")
-
-            self.sets[set_name]["price"] += stock_item["price"]
-            self.sets[set_name]["total_quantity"] += stock_item["quantity"]
-            self.sets[set_name]["items"].append(stock_item)
-
-        ordered_sets = list(self.sets.items())
-        ordered_sets.append(ordered_sets.pop(0))
-
-        options = []
-        for set_name, data in ordered_sets:
-            price = data["price"]
-            total_quantity = data["total_quantity"]
-
-            items: list[Stock] = sorted(data["items"], key=lambda x: x["price"])
-
-            if total_quantity <= 0:
-                continue
-
-            if set_name != "":
-                options.append(
-                    discord.SelectOption(
-                        label=f"{set_name} Set",
-                        description=f"${price:,}",
-                        value=f"{set_name} Set"
-                    )
-                )
-
-            for item in items:
-                objectId = item["_id"]
-                name = item["name"]
-                price = item["price"]
-                quantity = item["quantity"]
-
-                if quantity <= 0:
-                    continue
-
-                options.append(
-                    discord.SelectOption(
-                        label=f"{set_name} {name}",
-                        description=f"${price:,} | {quantity} in stock",
-                        value=str(objectId)
-                    )
-                )
-
-        option_chunks = split_list(options, 25)
-        for i, chunk in enumerate(option_chunks):
+        self.catalog = catalog
+        self.cart = Cart(catalog)
+
+        for i, chunk in enumerate(catalog.purchase_options):
             select = discord.ui.Select(
                 placeholder = "Select your items",
                 custom_id=f"purchase-{i}",
-                options=chunk
+                options=list(chunk)
             )
 
             if i > 0:
@@ -427,6 +433,15 @@ class PurchaseDropdown(discord.ui.View):
             select.callback = self.selection_callback
             self.add_item(select)
 
+        remove_last = discord.ui.Button(
+            label="Remove Last",
+            style=discord.ButtonStyle.secondary,
+            custom_id="remove_last"
+        )
+
+        remove_last.callback = self.remove_last_callback
+        self.add_item(remove_last)
+
         checkout = discord.ui.Button(
             label="Checkout",
             style=discord.ButtonStyle.primary,
@@ -436,24 +451,19 @@ class PurchaseDropdown(discord.ui.View):
         checkout.callback = self.checkout_callback
         self.add_item(checkout)
 
-    async def selection_callback(self, interaction: discord.Interaction):
-        values = interaction.data["values"][0].rsplit(" ", 1)
-
-        set_name = values[0]
-        item = values[-1]
-
-        if item == "Set":
-            items = self.sets[set_name]["items"]
-            self.values.extend([str(x["_id"]) for x in items])
-        else:
-            self.values.append(item)
+    @property
+    def reason(self) -> str:
+        if not self.cart:
+            return ""
 
-        stock_collection: Collection[Stock] = interaction.client.database.get_collection("stock")
-        stock_names = {str(item["_id"]): f"{item.get('set', '')} {item['name']}" for item in stock_collection.find()}
-        stock_prices = {str(item["_id"]): f"{item['price']}" for item in stock_collection.find()}
+        return "\n- " + "\n- ".join(self.cart.labels)
 
-        self.items = [stock_names[id] for id in self.values]
-        self.reason = "\n- " + "\n- ".join(self.items)
+    def cart_embed(self, guild: discord.Guild) -> discord.Embed:
+        if not self.cart:
+            return discord.Embed(
+                color=0x599ae0,
+                description=f"Please select the items you'd like to purchase:"
+            )
 
         embed = discord.Embed(
             color=0x599ae0,
@@ -461,24 +471,50 @@ class PurchaseDropdown(discord.ui.View):
             description=self.reason,
         )
 
-        self.subtotal = sum(int(stock_prices[id]) for id in self.values)
-        self.total = self.subtotal - calc_discount(self.subtotal, len(self.values))
-
         embed.set_footer(
-            icon_url=interaction.guild.icon,
-            text=f"Subtotal: ${self.subtotal:,}\nTotal: ${self.total:,}"
+            icon_url=guild.icon,
+            text=f"Subtotal: ${self.cart.subtotal:,}\nTotal: ${self.cart.total:,}"
         )
 
-        await interaction.response.edit_message(embed=embed, view=self)
+        return embed
+
+    async def selection_callback(self, interaction: discord.Interaction):
+        values = interaction.data["values"][0].rsplit(" ", 1)
+
+        set_name = values[0]
+        item = values[-1]
+
+        if item == "Set":
+            self.cart.add_set(set_name)
+        else:
+            self.cart.add(ObjectId(item))
+
+        await interaction.response.edit_message(embed=self.cart_embed(interaction.guild), view=self)
+
+    async def remove_last_callback(self, interaction: discord.Interaction):
+        self.cart.pop()
+        await interaction.response.edit_message(embed=self.cart_embed(interaction.guild), view=self)
 
     async def checkout_callback(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
+
+        if not self.cart:
+            await interaction.followup.send("Please select at least one item.", ephemeral=True)
+            return
+
+        if self.cart.revalidate():
+            await interaction.edit_original_response(embed=self.cart_embed(interaction.guild), view=self)
+            await interaction.followup.send("The shop has changed since you opened it. Please review your items and check out again.", ephemeral=True)
+            return
+
         purchase_data = {
-            "items": self.values,
-            "subtotal": self.subtotal,
-            "total": self.total,
+            "items": [str(id) for id in self.cart.lines],
+            "subtotal": self.cart.subtotal,
+            "total": self.cart.total,
         }
-        await create_ticket(interaction, "Purchase", self.reason, purchase_data)
+
+        # Stock is reserved inside create_ticket, after the payment method is chosen.
+        await create_ticket(interaction, "Purchase", self.reason, purchase_data, reserve=Counter(self.cart.lines))
 
 class PurchasePanel(discord.ui.View):
     def __init__(self):
@@ -491,7 +527,7 @@ class PurchasePanel(discord.ui.View):
             description=f"Please select the items you'd like to purchase:"
         )
 
-        await interaction.response.send_message(embed=embed, view=PurchaseDropdown(interaction.client), ephemeral=True)
+        await interaction.response.send_message(embed=embed, view=PurchaseDropdown(interaction.client.catalog), ephemeral=True)
 
     @discord.ui.button(emoji="\N{hourglass}", label="Exclusive", style=discord.ButtonStyle.primary, custom_id="exclusive_ticket")
     async def exclusive_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
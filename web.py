@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from quart import Quart, Response, jsonify, request
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import parse_range_header
+
+from _types import Ticket, TicketMessage
+from ticket_log import render_messages
+from transcript_index import TranscriptIndex
+from utils import read_decompressed, transcript_path, write_compressed
+
+
+@dataclass
+class CachedTranscript:
+    data: bytes
+    encoding: str
+    etag: str
+    last_modified: datetime
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def read_transcript(channel_id: str, encoding: str) -> CachedTranscript | None:
+    """Reads a transcript from the volume in ``encoding`` ("gzip" or "identity")."""
+
+    path = transcript_path(channel_id)
+    if os.path.exists(path):
+        data = read_decompressed(path) if encoding == "identity" else read_file(path)
+    else:
+        # Transcripts saved before compression was added.
+        path = transcript_path(channel_id, compressed=False)
+        if not os.path.exists(path):
+            return None
+
+        encoding = "identity"
+        data = read_file(path)
+
+    # Strong ETags are per representation, so the encoding is part of it.
+    etag = f"{hashlib.sha256(data).hexdigest()[:32]}-{encoding}"
+    last_modified = datetime.fromtimestamp(int(os.stat(path).st_mtime), timezone.utc)
+
+    return CachedTranscript(data, encoding, etag, last_modified)
+
+
+class TranscriptCache:
+    """Size-bounded LRU of recently served transcripts, keyed by channel and encoding.
+
+    Transcripts never change once written, so hot ones are served from memory
+    without touching the volume. Concurrent misses for the same transcript share
+    a single read.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[tuple[str, str], CachedTranscript] = OrderedDict()
+        self._loading: dict[tuple[str, str], asyncio.Task] = {}
+
+    async def get(self, channel_id: str, encoding: str) -> CachedTranscript | None:
+        key = (channel_id, encoding)
+
+        transcript = self.entries.get(key)
+        if transcript is not None:
+            self.entries.move_to_end(key)
+            return transcript
+
+        task = self._loading.get(key)
+        if task is None:
+            task = asyncio.create_task(asyncio.to_thread(read_transcript, channel_id, encoding))
+            self._loading[key] = task
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+
+        transcript = await task
+        if transcript is not None:
+            self._put(key, transcript)
+
+        return transcript
+
+    def _put(self, key: tuple[str, str], transcript: CachedTranscript) -> None:
+        if len(transcript.data) > self.max_bytes:
+            return
+
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous.data)
+
+        self.entries[key] = transcript
+        self.size += len(transcript.data)
+
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted.data)
+
+
+transcript_cache = TranscriptCache(int(os.getenv("TRANSCRIPT_CACHE_BYTES", 64 * 1024 * 1024)))
+transcript_index = TranscriptIndex()
+database: AsyncIOMotorDatabase = None
+_rendering: dict[str, asyncio.Task] = {}
+
+
+def write_rendered(channel_id: str, title: str, messages: list[TicketMessage]) -> None:
+    write_compressed(transcript_path(channel_id), render_messages(title, messages).encode())
+
+
+async def render_captured(channel_id: str) -> bool:
+    """Renders a closed ticket's captured messages to the volume.
+
+    Returns whether a transcript was written. Concurrent first views of the
+    same ticket share a single render.
+    """
+
+    task = _rendering.get(channel_id)
+    if task is None:
+        task = asyncio.create_task(_render_captured(channel_id))
+        _rendering[channel_id] = task
+        task.add_done_callback(lambda _: _rendering.pop(channel_id, None))
+
+    return await task
+
+
+async def _render_captured(channel_id: str) -> bool:
+    ticket: Ticket = await database.get_collection("tickets").find_one({"channel_id": int(channel_id)})
+
+    # Open tickets are still changing, so only closed ones are rendered and kept.
+    if ticket is None or ticket["open"] or not ticket.get("captured"):
+        return False
+
+    cursor = database.get_collection("ticket_messages").find({"channel_id": int(channel_id)}).sort("_id", 1)
+    messages: list[TicketMessage] = await cursor.to_list(None)
+
+    if not messages:
+        return False
+
+    title = f"{ticket['category']} ticket of {ticket['username']}"
+    await asyncio.to_thread(write_rendered, channel_id, title, messages)
+    return True
+
+
+def range_response(response: Response, transcript: CachedTranscript) -> Response:
+    """Narrows a full response to the single byte range requested, if any.
+
+    Multiple ranges, other units and ranges whose If-Range validator no longer
+    matches are answered with the full body, as the RFC allows.
+    """
+
+    requested = parse_range_header(request.headers.get("Range"))
+    if requested is None or requested.units != "bytes" or len(requested.ranges) != 1:
+        return response
+
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != transcript.etag:
+        return response
+    if if_range.date is not None and if_range.date != transcript.last_modified:
+        return response
+
+    size = len(transcript.data)
+    span = requested.range_for_length(size)
+
+    if span is None:
+        response.set_data(b"")
+        response.status_code = 416
+        response.headers["Content-Range"] = f"bytes */{size}"
+        return response
+
+    start, stop = span
+    response.set_data(transcript.data[start:stop])
+    response.status_code = 206
+    response.content_range = ContentRange("bytes", start, stop, size)
+    return response
+
+
+app = Quart(__name__)
+
+
+@app.before_serving
+async def connect_database():
+    global database
+
+    client = AsyncIOMotorClient(
+        os.getenv("ATLAS_URI"),
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+        serverSelectionTimeoutMS=5000,
+    )
+    database = client.get_database("bry")
+
+
+@app.after_serving
+async def close_database():
+    database.client.close()
+
+
+@app.route('/view')
+async def view():
+    channel_id = request.args.get('channel_id')
+    if not channel_id:
+        return "Error: URL parameter is missing.", 400
+
+    if not channel_id.isdigit():
+        return "Error: Invalid channel ID.", 400
+
+    encoding = "gzip" if "gzip" in request.accept_encodings else "identity"
+    transcript = await transcript_cache.get(channel_id, encoding)
+
+    if transcript is None and await render_captured(channel_id):
+        transcript = await transcript_cache.get(channel_id, encoding)
+
+    if transcript is None:
+        return "Error: Transcript not found.", 404
+
+    response = Response(transcript.data, mimetype="text/html")
+    response.set_etag(transcript.etag)
+    response.last_modified = transcript.last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    response.vary.add("Accept-Encoding")
+
+    if transcript.encoding == "gzip":
+        response.headers["Content-Encoding"] = "gzip"
+
+    # make_conditional only answers If-None-Match and If-Modified-Since here. Quart's
+    # own range handling rejects valid suffix and last-byte ranges, so ranges are
+    # served below.
+    await response.make_conditional(request)
+
+    if response.status_code == 200:
+        response.accept_ranges = "bytes"
+        return range_response(response, transcript)
+
+    return response
+
+@app.route('/search')
+async def search():
+    token = os.getenv("SEARCH_TOKEN")
+    if not token:
+        return "Error: Search is disabled.", 404
+
+    provided = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(provided.encode(), token.encode()):
+        return "Error: Unauthorized.", 401
+
+    query = request.args.get('q')
+    if not query:
+        return "Error: URL parameter is missing.", 400
+
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    hits = await transcript_index.search(query, request.args.get('category'), limit)
+
+    return jsonify([asdict(hit) for hit in hits])
+
+
+if __name__ == "__main__":
+    # Standalone mode: serve the API from its own pool of worker processes, e.g.
+    # with WEB_STANDALONE=1 set on the bot so it does not serve it as well.
+    from dotenv import load_dotenv
+    from hypercorn.config import Config
+    from hypercorn.run import run
+
+    from utils import setup_logging
+
+    load_dotenv()
+    setup_logging()
+
+    config = Config()
+    config.application_path = "web:app"
+    config.bind = [f"0.0.0.0:{os.getenv('PORT', 5000)}"]
+    config.workers = int(os.getenv("WEB_WORKERS", os.cpu_count() or 1))
+    config.accesslog = "-"
+
+    run(config)